@@ -0,0 +1,429 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import traceback
+import subprocess
+import logging as log
+from config import get_home
+
+# commands handled by the CLI itself, never forwarded to the agent
+local_commands = ["agent"]
+# client environment applied while the agent runs a command
+forwarded_env = ["DOCKER_CONFIG"]
+start_timeout = 15
+latency_samples = 2000
+
+
+def get_socket_path():
+    """
+    Unix socket of the agent, in a folder only the user can open (EFS home does not support sockets across apps)
+    """
+    return os.getenv("SDOCKER_AGENT_SOCKET") or f"{tempfile.gettempdir()}/sdocker-{os.getuid()}/agent.sock"
+
+
+def get_latency_filename():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/command-latency.jsonl"
+
+
+def send(connection, message):
+    connection.sendall((json.dumps(message, default=str) + "\n").encode())
+
+
+def receive(connection_file):
+    line = connection_file.readline()
+    if not line:
+        raise ConnectionError("Agent closed the connection")
+    return json.loads(line)
+
+
+def connect(timeout=None):
+    """
+    Connected socket to the agent, None when no agent is running
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(get_socket_path())
+        return connection
+    except OSError:
+        connection.close()
+        return None
+
+
+def request(message, timeout=5):
+    """
+    Single request/response exchange with the agent (status, stop), None when no agent is running
+    """
+    connection = connect(timeout)
+    if connection is None:
+        return None
+    with connection, connection.makefile("r") as connection_file:
+        send(connection, message)
+        return receive(connection_file)
+
+
+def run_in_agent(argv):
+    """
+    Forward a CLI call to the agent and stream its output. Returns exit code, or None when no agent is
+    running or the agent is busy with another command, the caller then runs the command in-process
+    """
+    connection = connect()
+    if connection is None:
+        return None
+    with connection, connection.makefile("r") as connection_file:
+        send(connection, {
+            "Argv": argv,
+            "Cwd": os.getcwd(),
+            "Env": {name: os.environ[name] for name in forwarded_env if name in os.environ}
+        })
+        while True:
+            message = receive(connection_file)
+            if "Busy" in message:
+                return None
+            if "Stdout" in message:
+                sys.stdout.write(message["Stdout"])
+                sys.stdout.flush()
+            elif "Stderr" in message:
+                sys.stderr.write(message["Stderr"])
+                sys.stderr.flush()
+            elif "ExitCode" in message:
+                return message["ExitCode"]
+
+
+def record_latency(command, mode, seconds, exit_code):
+    """
+    Append one line per CLI call, the file is cut down to the last latency_samples lines when it doubles
+    """
+    filename = get_latency_filename()
+    try:
+        with open(filename, "a") as file:
+            file.write(json.dumps({
+                "Timestamp": round(time.time(), 3),
+                "Command": command,
+                "Mode": mode,
+                "Seconds": round(seconds, 3),
+                "ExitCode": exit_code
+            }) + "\n")
+        if os.path.getsize(filename) > latency_samples * 200:
+            with open(filename, "r") as file:
+                lines = file.readlines()[-latency_samples:]
+            with open(filename, "w") as file:
+                file.writelines(lines)
+    except Exception as error:
+        log.error(f"Failed to record command latency: {error}")
+
+
+def load_latencies():
+    try:
+        with open(get_latency_filename(), "r") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return []
+    samples = []
+    for line in lines:
+        try:
+            samples.append(json.loads(line))
+        except ValueError:
+            pass
+    return samples
+
+
+def format_latencies(samples):
+    """
+    Median and p90 latency of successful calls per command, agent and in-process side by side
+    """
+    latencies = {}
+    for sample in samples:
+        if sample.get("ExitCode") == 0:
+            latencies.setdefault(sample["Command"], {}).setdefault(sample["Mode"], []).append(sample["Seconds"])
+    if len(latencies) == 0:
+        return "No command latencies recorded"
+
+    def summary(values):
+        if not values:
+            return "-"
+        values = sorted(values)
+        return f"{values[len(values) // 2]:.3f}s / {values[min(len(values) - 1, int(len(values) * 0.9))]:.3f}s ({len(values)})"
+
+    lines = [f"{'command':<24}{'agent p50 / p90 (calls)':<34}{'in-process p50 / p90 (calls)'}"]
+    for command in sorted(latencies):
+        modes = latencies[command]
+        lines.append(f"{command:<24}{summary(modes.get('agent')):<34}{summary(modes.get('in-process'))}")
+    return "\n".join(lines)
+
+
+class RequestOutput():
+    """
+    Stand-in for sys.stdout/sys.stderr, output written while a command runs goes to its client.
+    Commands run one at a time, so output of their worker threads goes to the same client.
+    """
+    def __init__(self, stream, key):
+        self.stream = stream
+        self.key = key
+        self.connection = None
+
+    def write(self, text):
+        connection = self.connection
+        if connection is None:
+            return self.stream.write(text)
+        try:
+            send(connection, {self.key: text})
+        except OSError:
+            # client went away, the command still runs to completion
+            self.connection = None
+        return len(text)
+
+    def flush(self):
+        if self.connection is None:
+            self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Agent():
+    """
+    Long-lived process serving sdocker CLI calls over a Unix socket. It keeps imported modules, a boto3
+    session and EC2 client, the resolved configuration, the host registry and pooled mTLS sessions to hosts
+    (docker_api clients) between calls. One command runs at a time, clients calling while a command runs
+    are told the agent is busy and run in-process.
+    """
+    def __init__(self):
+        self.stdout = sys.stdout = RequestOutput(sys.stdout, "Stdout")
+        self.stderr = sys.stderr = RequestOutput(sys.stderr, "Stderr")
+        import boto3
+        from parse import ParseArgs
+        from commands import Commands
+        from hosts import HostRegistry
+        self.parse_args = ParseArgs
+        self.commands = Commands
+        self.session = boto3.session.Session()
+        self.ec2_clients = {}
+        self.registry = HostRegistry()
+        self.config = None
+        self.config_state = None
+        self.config_loaded = 0
+        self.command_lock = threading.Lock()
+        self.started = time.time()
+        self.served = 0
+        self.stopping = False
+
+    def get_ec2_client(self, region):
+        if region not in self.ec2_clients:
+            self.ec2_clients[region] = self.session.client("ec2", region_name=region)
+        return self.ec2_clients[region]
+
+    def read_config(self, refresh, fields):
+        """
+        Configuration of the last call is reused until sdocker.conf or the configuration cache changes,
+        or half of ConfigCacheTTL has passed (ReadConfig then starts the background refresh)
+        """
+        import copy
+        from config import ReadConfig, get_config_fingerprint, get_config_cache_filename, get_cache_ttl
+
+        try:
+            cache_mtime = os.path.getmtime(get_config_cache_filename())
+        except OSError:
+            cache_mtime = None
+        state = (get_config_fingerprint(), cache_mtime)
+        if not refresh and self.config and self.config_state == state and \
+                time.time() - self.config_loaded < get_cache_ttl() / 2:
+            log.info("Using configuration held by agent")
+            return copy.deepcopy(self.config)
+        config = ReadConfig(refresh=refresh, fields=fields).config
+        if "VpcId" in config.keys():
+            try:
+                cache_mtime = os.path.getmtime(get_config_cache_filename())
+            except OSError:
+                cache_mtime = None
+            self.config = copy.deepcopy(config)
+            self.config_state = (get_config_fingerprint(), cache_mtime)
+            self.config_loaded = time.time()
+        return config
+
+    def run_command(self, message, connection):
+        """
+        Run one CLI call with its output sent to connection. Returns exit code
+        """
+        start = time.perf_counter()
+        saved_env = {name: os.environ.get(name) for name in forwarded_env}
+        saved_cwd = os.getcwd()
+        self.stdout.connection = self.stderr.connection = connection
+        try:
+            os.chdir(message["Cwd"])
+            for name in forwarded_env:
+                if name in message["Env"]:
+                    os.environ[name] = message["Env"][name]
+                else:
+                    os.environ.pop(name, None)
+            args = self.parse_args(message["Argv"]).args
+            refresh = args.refresh_config or (args.func == "config" and args.action == "refresh")
+            config = self.read_config(refresh, self.commands.required_config[args.func])
+            config["StartupTime"] = time.perf_counter() - start
+            log.info(f"Agent startup took {config['StartupTime']:.3f}s before running {args.func}")
+            self.commands(args, config, ec2_client=self.get_ec2_client(config["Region"]), registry=self.registry)
+            exit_code = 0
+        except SystemExit as error:
+            exit_code = error.code if type(error.code) == int else int(error.code is not None)
+        except BaseException:
+            log.error(f"Agent command {message['Argv']} failed")
+            sys.stderr.write(traceback.format_exc())
+            exit_code = 1
+        finally:
+            self.stdout.connection = self.stderr.connection = None
+            os.chdir(saved_cwd)
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self.served += 1
+        log.info(f"Agent ran {message['Argv']} in {time.perf_counter() - start:.3f}s, exit code {exit_code}")
+        return exit_code
+
+    def status(self):
+        from docker_api import pooled_hosts
+
+        return {
+            "Pid": os.getpid(),
+            "Uptime": round(time.time() - self.started),
+            "Served": self.served,
+            "Busy": self.command_lock.locked(),
+            "PooledHosts": pooled_hosts()
+        }
+
+    def handle(self, connection):
+        with connection, connection.makefile("r") as connection_file:
+            try:
+                message = receive(connection_file)
+                if message.get("Status"):
+                    send(connection, self.status())
+                elif message.get("Stop"):
+                    send(connection, {"Stopping": True})
+                    self.stopping = True
+                elif not self.command_lock.acquire(blocking=False):
+                    send(connection, {"Busy": True})
+                else:
+                    try:
+                        exit_code = self.run_command(message, connection)
+                    finally:
+                        self.command_lock.release()
+                    send(connection, {"ExitCode": exit_code})
+                    self.prune_clients()
+            except (OSError, ValueError) as error:
+                log.info(f"Agent connection closed: {error}")
+
+    def prune_clients(self):
+        """
+        Keep pooled mTLS sessions of registered hosts only
+        """
+        from docker_api import close_other_clients
+
+        try:
+            close_other_clients([host["InstanceId"] for host in self.registry.hosts()])
+        except Exception as error:
+            log.error(f"Failed to prune docker clients: {error}")
+
+    def warm_clients(self):
+        """
+        Open mTLS sessions to registered hosts in the background, the first command on a host skips the handshake
+        """
+        from docker_api import get_client
+
+        for host in self.registry.hosts():
+            try:
+                get_client(get_home(), host["InstanceType"], host["InstanceId"], host["InstanceDns"], host["Port"]).ping()
+            except Exception as error:
+                log.info(f"Unable to warm docker client of {host['InstanceId']}: {error}")
+
+    def serve(self):
+        socket_path = get_socket_path()
+        os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(socket_path):
+            if request({"Status": True}) is not None:
+                raise RuntimeError(f"An agent is already listening on {socket_path}")
+            os.remove(socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        self.server.listen()
+        # accept wakes up every second to notice a stop request
+        self.server.settimeout(1)
+        log.info(f"Agent {os.getpid()} listening on {socket_path}")
+        threading.Thread(target=self.warm_clients, daemon=True).start()
+        try:
+            while not self.stopping:
+                try:
+                    connection, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        finally:
+            self.server.close()
+            # a running command is finished before the agent exits
+            with self.command_lock:
+                pass
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            log.info(f"Agent {os.getpid()} stopped after serving {self.served} commands")
+
+
+def start_agent():
+    """
+    Start a detached `sdocker agent run` process and wait until it answers
+    """
+    if request({"Status": True}) is not None:
+        print(f"Agent is already running on {get_socket_path()}")
+        return
+    sdocker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sdocker")
+    process = subprocess.Popen(
+        [sys.executable, sdocker, "agent", "run"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    deadline = time.time() + start_timeout
+    while time.time() < deadline:
+        status = request({"Status": True})
+        if status is not None:
+            print(f"Agent {status['Pid']} is running on {get_socket_path()}")
+            log.info(f"Started agent {status['Pid']}")
+            return
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    message = f"Agent did not start, see {get_home()}/.sagemaker_studio_docker_cli/sdocker.log"
+    log.error(message)
+    raise RuntimeError(message)
+
+
+def agent_command(args):
+    """
+    `agent start|stop|status|run`, status also reports command latency with and without the agent
+    """
+    if args.action == "run":
+        Agent().serve()
+    elif args.action == "start":
+        start_agent()
+    elif args.action == "stop":
+        if request({"Stop": True}) is None:
+            print("Agent is not running")
+        else:
+            print("Agent stopped")
+    else:
+        status = request({"Status": True})
+        if status is None:
+            print("Agent is not running")
+        else:
+            state = "running a command" if status["Busy"] else "idle"
+            print(f"Agent {status['Pid']} is {state}, up {status['Uptime']}s, served {status['Served']} commands, "
+                  f"{len(status['PooledHosts'])} pooled host connections")
+        print(format_latencies(load_latencies()))
@@ -0,0 +1,70 @@
+import logging as log
+from config import get_home, default_image_cache_ttl
+from cache import read_cache, write_cache
+
+default_image_name = "AWS Deep Learning Base AMI (Amazon Linux 2) Version *"
+ssm_prefix = "resolve:ssm:"
+
+
+def get_image_cache_filename():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/image-cache.json"
+
+
+def get_architecture(instance_type_info):
+    """
+    Architecture of AMI to use for an instance type, from ec2:DescribeInstanceTypes response
+    """
+    architectures = instance_type_info["ProcessorInfo"]["SupportedArchitectures"]
+    if "x86_64" in architectures:
+        return "x86_64"
+    return architectures[0]
+
+
+def newest_image(images):
+    """
+    Pick the most recently created image, DescribeImages response is not sorted
+    """
+    if len(images) == 0:
+        raise ValueError(f"No available images found matching \"{default_image_name}\"")
+    return max(images, key=lambda image: image["CreationDate"])
+
+
+def resolve_image_id(ec2_client, region, architecture, image_id=None, ttl=default_image_cache_ttl):
+    """
+    Resolve AMI id used for Docker Host.
+    image_id: configured ImageId, an AMI id is used as is, a "resolve:ssm:<parameter name>" alias is
+    resolved with ssm:GetParameter. When not configured, the newest AWS Deep Learning Base AMI for
+    the architecture is used. Resolved ids are cached per region and architecture for ttl seconds.
+    """
+    if image_id and not image_id.startswith(ssm_prefix):
+        return image_id
+    source = image_id if image_id else default_image_name
+    cache_filename = get_image_cache_filename()
+    cache_key = f"{region}|{architecture}|{source}"
+    cached_image, age = read_cache(cache_filename, cache_key, ttl)
+    if cached_image:
+        log.info(f"Using cached image {cached_image['ImageId']} for {source} ({int(age)}s old)")
+        return cached_image["ImageId"]
+
+    if image_id:
+        import boto3
+        ssm_client = boto3.client("ssm", region_name=region)
+        response = ssm_client.get_parameter(Name=image_id[len(ssm_prefix):])
+        image = {"ImageId": response["Parameter"]["Value"]}
+    else:
+        response = ec2_client.describe_images(
+            Owners=["amazon"],
+            Filters=[
+                {"Name": "name", "Values": [default_image_name]},
+                {"Name": "architecture", "Values": [architecture]},
+                {"Name": "state", "Values": ["available"]}
+            ]
+        )
+        newest = newest_image(response["Images"])
+        image = {"ImageId": newest["ImageId"], "Name": newest["Name"], "CreationDate": newest["CreationDate"]}
+    log.info(f"Resolved image {image['ImageId']} for {source} ({architecture})")
+    try:
+        write_cache(cache_filename, cache_key, image)
+    except Exception as error:
+        log.error(f"Failed to write image cache: {error}")
+    return image["ImageId"]
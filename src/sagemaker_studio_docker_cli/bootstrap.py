@@ -1,4 +1,33 @@
-def generate_bootstrap_script(home, efs_ip_address, port, user_uid, gpu_option, docker_image_name, pre_bootstrap, post_bootstrap, create_certs, additional_ports):
+from idle import idle_check_interval, idle_cpu_threshold, idle_gpu_threshold, idle_api_bytes_threshold
+
+# registry:2 container run on the host as pull-through cache of Docker Hub when RegistryMirror is "local"
+mirror_image = "registry:2"
+mirror_port = 5000
+# docker bridge gateway, how the dind container reaches ports published on the host
+bridge_gateway = "172.17.0.1"
+
+
+def get_mirror_option(registry_mirror):
+    """
+    dockerd option for RegistryMirror, None, "local" or the URL of a registry mirror
+    """
+    if not registry_mirror:
+        return ""
+    if registry_mirror == "local":
+        return f"--registry-mirror=http://{bridge_gateway}:{mirror_port}"
+    return f"--registry-mirror={registry_mirror}"
+
+
+def generate_bootstrap_script(home, efs_ip_address, port, user_uid, gpu_option, docker_image_name, pre_bootstrap, post_bootstrap, additional_ports, persistent_volume=False, instance_store=False, prefetch_images=[], registry_mirror=None, efs_mount_targets={}, idle_timeout=0, idle_action="terminate"):
+    """
+    efs_mount_targets: {availability zone: mount target ip address}, hosts mount EFS from the mount target
+    in their availability zone, efs_ip_address is used in other availability zones
+    idle_timeout: seconds without activity after which the idle monitor shuts the host down, 0 disables it
+    """
+    mirror_option = get_mirror_option(registry_mirror)
+    mount_target_cases = "\n".join(
+        f"        {availability_zone}) EFS_IP={ip_address} ;;" for availability_zone, ip_address in efs_mount_targets.items()
+    )
     bootstrap_script = f"""Content-Type: multipart/mixed; boundary="//"
 MIME-Version: 1.0
 
@@ -22,88 +51,350 @@ Content-Disposition: attachment; filename="userdata.txt"
 set -x
 exec > >(tee /var/log/user-data.log|logger -t user-data -s 2>/dev/console) 2>&1
 
+    # phase timings, copied to dockerd-logs/bootstrap-timings.jsonl on EFS and read by `sdocker timings`
+    _timing() {{
+        echo "{{\\"Phase\\": \\"$1\\", \\"Event\\": \\"$2\\", \\"Time\\": $(date +%s.%N)}}" >> /var/log/sdocker-timings.jsonl
+    }}
+    _timing boot start
+
+    _timing pre-bootstrap start
     {pre_bootstrap}
+    _timing pre-bootstrap end
+
+    if [ -f /etc/sdocker-baked ]
+    then
+        # image created by sdocker bake-ami, docker images are already pulled
+        echo "Using baked image $(cat /etc/sdocker-baked)"
+    fi
+
+    # pull docker daemon image in background while EFS is mounted and certificates are delivered
+    (
+        _timing image-pull start
+        sudo -u ec2-user docker image inspect {docker_image_name} &> /dev/null || sudo -u ec2-user docker pull {docker_image_name}
+        _timing image-pull end
+    ) &
+    PULL_PID=$!
+
+    TOKEN=$(curl -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 3600")
 
-    echo "Mounting EFS to /root"
-    
+    instance_type=$(curl -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-type)
+    instance_id=$(curl -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-id)
+    availability_zone=$(curl -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/placement/availability-zone)
+
+    # EFS mount target in the availability zone of the host, avoids cross-AZ NFS traffic
+    case "$availability_zone" in
+{mount_target_cases}
+        *) EFS_IP={efs_ip_address} ;;
+    esac
+
+    echo "Mounting EFS from $EFS_IP to /root"
+
+    _timing mount-root start
     sudo mkdir -p /root
     sudo mount -t nfs \
     -o nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2 \
-    {efs_ip_address}:/{user_uid} \
+    $EFS_IP:/{user_uid} \
     /root
-    
+    _timing mount-root end
+
+    # EFS is mounted once, other paths are bind mounts sharing the same NFS client
+    _timing mount-home start
     sudo mkdir -p /home/sagemaker-user
-    sudo mount -t nfs \
-    -o nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2 \
-    {efs_ip_address}:/{user_uid} \
-    /home/sagemaker-user
-    
-    {create_certs}
-    
-    TOKEN=$(curl -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 3600")
-    
-    instance_type=$(curl -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-type)
-    instance_id=$(curl -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-id)
-        
+    mountpoint -q /home/sagemaker-user || sudo mount --bind /root /home/sagemaker-user
+    _timing mount-home end
+
+    # NFS write throughput and metadata round trip latency, recorded with the bootstrap timings
+    (
+        PROBE=/root/.sagemaker_studio_docker_cli/.nfs-probe-$instance_id
+        PROBE_START=$(date +%s.%N)
+        dd if=/dev/zero of=$PROBE bs=1M count=32 conv=fsync 2> /dev/null
+        PROBE_WRITE=$(date +%s.%N)
+        for attempt in $(seq 1 20)
+        do
+            touch $PROBE.$attempt
+            stat $PROBE.$attempt > /dev/null
+        done
+        PROBE_END=$(date +%s.%N)
+        rm -f $PROBE $PROBE.*
+        echo "{{\\"Phase\\": \\"nfs-probe\\", \\"Event\\": \\"result\\", \\"Time\\": $PROBE_END, \\"AvailabilityZone\\": \\"$availability_zone\\", \\"MountTarget\\": \\"$EFS_IP\\", \\"WriteMiBps\\": $(awk "BEGIN {{print 32 / ($PROBE_WRITE - $PROBE_START)}}"), \\"LatencyMs\\": $(awk "BEGIN {{print ($PROBE_END - $PROBE_WRITE) * 1000 / 40}}")}}" >> /var/log/sdocker-timings.jsonl
+        mkdir -p /root/.sagemaker_studio_docker_cli/${{instance_type}}_${{instance_id}}/dockerd-logs
+        cp /var/log/sdocker-timings.jsonl /root/.sagemaker_studio_docker_cli/${{instance_type}}_${{instance_id}}/dockerd-logs/bootstrap-timings.jsonl
+    ) &
+
+    DOCKER_DATA_OPTION=""
+    if [ "{str(persistent_volume).lower()}" == "true" ]
+    then
+        # persistent docker data volume, attached by sdocker which writes its id to EFS once attached
+        _timing docker-volume start
+        VOLUME_FILE=/root/.sagemaker_studio_docker_cli/${{instance_type}}_${{instance_id}}/docker-volume
+        for attempt in $(seq 1 300)
+        do
+            [ -s "$VOLUME_FILE" ] && break
+            sleep 1
+        done
+        # "none" is written when sdocker could not attach a volume
+        VOLUME_ID=$(cat $VOLUME_FILE 2> /dev/null | grep "^vol-")
+        DEVICE=""
+        for attempt in $(seq 1 120)
+        do
+            [ -z "$VOLUME_ID" ] && break
+            for candidate in /dev/disk/by-id/nvme-Amazon_Elastic_Block_Store_${{VOLUME_ID//-/}} /dev/sdf /dev/xvdf
+            do
+                [ -b "$candidate" ] && DEVICE=$candidate && break
+            done
+            [ -n "$DEVICE" ] && break
+            sleep 1
+        done
+        if [ -n "$DEVICE" ]
+        then
+            sudo blkid $DEVICE || sudo mkfs.xfs $DEVICE
+            sudo mkdir -p /var/lib/sdocker-data
+            mountpoint -q /var/lib/sdocker-data || sudo mount $DEVICE /var/lib/sdocker-data
+            DOCKER_DATA_OPTION="-v /var/lib/sdocker-data:/var/lib/docker"
+            echo "{{\\"VolumeId\\": \\"$VOLUME_ID\\", \\"UsedBytes\\": $(df --output=used -B1 /var/lib/sdocker-data | tail -1)}}" > /var/log/sdocker-docker-volume.json
+        else
+            echo "Docker data volume not attached, using root volume"
+        fi
+        _timing docker-volume end
+    fi
+
+    if [ -z "$DOCKER_DATA_OPTION" ] && [ "{str(instance_store).lower()}" == "true" ]
+    then
+        # local NVMe instance store as docker data-root, RAID0 across devices. Instance store is wiped
+        # when the instance is stopped, so the array and filesystem are recreated when missing
+        _timing instance-store start
+        DEVICES=$(lsblk -d -n -p -o NAME,MODEL | grep "Amazon EC2 NVMe Instance Storage" | awk '{{print $1}}')
+        COUNT=$(echo $DEVICES | wc -w)
+        # some AMIs already mount instance store, reuse their mount point
+        EXISTING=$(lsblk -n -o MOUNTPOINT $DEVICES 2> /dev/null | grep -v "^$" | head -1)
+        if [ -n "$EXISTING" ]
+        then
+            sudo mkdir -p $EXISTING/sdocker-data
+            DOCKER_DATA_OPTION="-v $EXISTING/sdocker-data:/var/lib/docker"
+        elif [ "$COUNT" -gt 0 ]
+        then
+            DEVICE=$DEVICES
+            if [ "$COUNT" -gt 1 ]
+            then
+                DEVICE=/dev/md/sdocker
+                command -v mdadm &> /dev/null || sudo yum install -y mdadm
+                [ -e $DEVICE ] || sudo mdadm --assemble $DEVICE $DEVICES || sudo mdadm --create $DEVICE --level=0 --raid-devices=$COUNT --run $DEVICES
+            fi
+            sudo blkid $DEVICE || sudo mkfs.xfs -f $DEVICE
+            sudo mkdir -p /var/lib/sdocker-data
+            mountpoint -q /var/lib/sdocker-data || sudo mount -o noatime $DEVICE /var/lib/sdocker-data
+            DOCKER_DATA_OPTION="-v /var/lib/sdocker-data:/var/lib/docker"
+        else
+            echo "No NVMe instance store found, using root volume"
+        fi
+        _timing instance-store end
+    fi
+
+    if [ "{registry_mirror}" == "local" ]
+    then
+        # pull-through cache of Docker Hub, kept next to docker data when it is on a persistent volume or instance store
+        MIRROR_DATA=/var/lib/sdocker-registry
+        mountpoint -q /var/lib/sdocker-data && MIRROR_DATA=/var/lib/sdocker-data/sdocker-registry
+        (
+            _timing registry-mirror start
+            if sudo -u ec2-user docker inspect sdocker-mirror &> /dev/null
+            then
+                sudo -u ec2-user docker start sdocker-mirror
+            else
+                sudo -u ec2-user docker run -d \
+                -p {mirror_port}:5000 \
+                -v $MIRROR_DATA:/var/lib/registry \
+                -e REGISTRY_PROXY_REMOTEURL=https://registry-1.docker.io \
+                --name sdocker-mirror \
+                {mirror_image}
+            fi
+            _timing registry-mirror end
+        ) &
+    fi
+
     if ( ! [[ "{home}" == "/home/sagemaker-user" ]] || [[ "{home}" == "/root" ]] )
     then
+        _timing mount-user-home start
         sudo mkdir -p {home}
-        sudo mount -t nfs \
-        -o nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2 \
-        {efs_ip_address}:/{user_uid} \
-        {home}
+        mountpoint -q {home} || sudo mount --bind /root {home}
+        _timing mount-user-home end
 
         CERTS={home}/.sagemaker_studio_docker_cli/${{instance_type}}_${{instance_id}}
         
         mkdir -p $CERTS/certs
         mkdir -p $CERTS/dockerd-logs
         
-        _tls_generate_certs "$CERTS/certs"
+        # certificates are issued by sdocker on the client and written to EFS right after launch
+        _timing cert-wait start
+        for attempt in $(seq 1 600)
+        do
+            [ -s "$CERTS/certs/server/cert.pem" ] && [ -s "$CERTS/certs/server/key.pem" ] && break
+            sleep 1
+        done
+        _timing cert-wait end
+        # readiness marker of this boot, `sdocker` compares it with the instance launch time
+        date +%s > $CERTS/dockerd-logs/certs-loaded
 
         chown -R {user_uid}:1001 $CERTS
         
-        sudo -u ec2-user docker run -d \
-        -p {port}:2376 \
-        -p {' -p '.join([aport + ':' + aport for aport in additional_ports])}\
-        {gpu_option} \
-        -v /root:/root \
-        -v /home/sagemaker-user:/home/sagemaker-user \
-        -v $CERTS/certs:/certs \
-        -v {home}:{home} \
-        --privileged \
-        --name dockerd-server \
-        -e DOCKER_TLS_CERTDIR="/certs" {docker_image_name} \
-        dockerd --tlsverify --tlscacert=/certs/ca/cert.pem --tlscert=/certs/server/cert.pem --tlskey=/certs/server/key.pem -H=0.0.0.0:2376
+        wait $PULL_PID
+        _timing dockerd-start start
+        # user data runs on every boot, restart existing daemon container when a stopped host is started
+        if sudo -u ec2-user docker inspect dockerd-server &> /dev/null
+        then
+            sudo -u ec2-user docker start dockerd-server
+        else
+            sudo -u ec2-user docker run -d \
+            -p {port}:2376 \
+            -p {' -p '.join([aport + ':' + aport for aport in additional_ports])}\
+            {gpu_option} \
+            -v /root:/root \
+            -v /home/sagemaker-user:/home/sagemaker-user \
+            -v $CERTS/certs:/certs \
+            -v {home}:{home} \
+            $DOCKER_DATA_OPTION \
+            --privileged \
+            --name dockerd-server \
+            -e DOCKER_TLS_CERTDIR="/certs" {docker_image_name} \
+            dockerd --tlsverify --tlscacert=/certs/ca/cert.pem --tlscert=/certs/server/cert.pem --tlskey=/certs/server/key.pem -H=0.0.0.0:2376 {mirror_option}
+        fi
     else
         CERTS=/root/.sagemaker_studio_docker_cli/${{instance_type}}_${{instance_id}}
 
         mkdir -p $CERTS/certs
         mkdir -p $CERTS/dockerd-logs
 
-        _tls_generate_certs "$CERTS/certs"
+        # certificates are issued by sdocker on the client and written to EFS right after launch
+        _timing cert-wait start
+        for attempt in $(seq 1 600)
+        do
+            [ -s "$CERTS/certs/server/cert.pem" ] && [ -s "$CERTS/certs/server/key.pem" ] && break
+            sleep 1
+        done
+        _timing cert-wait end
+        # readiness marker of this boot, `sdocker` compares it with the instance launch time
+        date +%s > $CERTS/dockerd-logs/certs-loaded
         
         chown -R {user_uid}:1001 $CERTS
         
-        sudo -u ec2-user docker run -d \
-        -p {port}:2376 \
-        -p {' -p '.join([aport + ':' + aport for aport in additional_ports])} \
-        {gpu_option} \
-        -v /root:/root \
-        -v /home/sagemaker-user:/home/sagemaker-user \
-        -v $CERTS/certs:/certs \
-        --privileged \
-        --name dockerd-server \
-        -e DOCKER_TLS_CERTDIR="/certs" {docker_image_name} \
-        dockerd --tlsverify --tlscacert=/certs/ca/cert.pem --tlscert=/certs/server/cert.pem --tlskey=/certs/server/key.pem -H=0.0.0.0:2376
+        wait $PULL_PID
+        _timing dockerd-start start
+        # user data runs on every boot, restart existing daemon container when a stopped host is started
+        if sudo -u ec2-user docker inspect dockerd-server &> /dev/null
+        then
+            sudo -u ec2-user docker start dockerd-server
+        else
+            sudo -u ec2-user docker run -d \
+            -p {port}:2376 \
+            -p {' -p '.join([aport + ':' + aport for aport in additional_ports])} \
+            {gpu_option} \
+            -v /root:/root \
+            -v /home/sagemaker-user:/home/sagemaker-user \
+            -v $CERTS/certs:/certs \
+            $DOCKER_DATA_OPTION \
+            --privileged \
+            --name dockerd-server \
+            -e DOCKER_TLS_CERTDIR="/certs" {docker_image_name} \
+            dockerd --tlsverify --tlscacert=/certs/ca/cert.pem --tlscert=/certs/server/cert.pem --tlskey=/certs/server/key.pem -H=0.0.0.0:2376 {mirror_option}
+        fi
+    fi
+    # wait for docker daemon to listen instead of a fixed sleep
+    for attempt in $(seq 1 60)
+    do
+        sudo -u ec2-user docker logs dockerd-server 2>&1 | grep -q "API listen on" && break
+        sleep 0.5
+    done
+    _timing dockerd-start end
+
+    if [ {idle_timeout} -gt 0 ] && [ -s $CERTS/idle-monitor.sh ]
+    then
+        # idle monitor written to EFS by sdocker, started on every boot so the idle window restarts when a stopped host is started
+        sudo install -m 755 $CERTS/idle-monitor.sh /usr/local/bin/sdocker-idle-monitor
+        sudo systemctl stop sdocker-idle-monitor &> /dev/null
+        sudo systemctl reset-failed sdocker-idle-monitor &> /dev/null
+        # Spot hosts are launched with InstanceInitiatedShutdownBehavior terminate, one-time Spot instances cannot stop
+        IDLE_ACTION={idle_action}
+        if [ "$(curl -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-life-cycle)" == "spot" ]
+        then
+            IDLE_ACTION=terminate
+        fi
+        sudo systemd-run --unit sdocker-idle-monitor \
+        --setenv=IDLE_TIMEOUT={idle_timeout} \
+        --setenv=IDLE_ACTION=$IDLE_ACTION \
+        --setenv=CHECK_INTERVAL={idle_check_interval} \
+        --setenv=CPU_THRESHOLD={idle_cpu_threshold} \
+        --setenv=GPU_THRESHOLD={idle_gpu_threshold} \
+        --setenv=API_BYTES_THRESHOLD={idle_api_bytes_threshold} \
+        --setenv=LOG_DIR=$CERTS/dockerd-logs \
+        --setenv=INSTANCE_ID=$instance_id \
+        --setenv=INSTANCE_TYPE=$instance_type \
+        --setenv=OWNER_UID={user_uid} \
+        /usr/local/bin/sdocker-idle-monitor
+    fi
+
+    if [ -n "{' '.join(prefetch_images)}" ]
+    then
+        # pull PrefetchImages concurrently into the docker daemon while sdocker waits for it to be reachable,
+        # images already on the host (baked AMIs) are copied from the host daemon instead of pulled
+        DIND="sudo -u ec2-user docker exec -i dockerd-server docker --tlsverify --tlscacert=/certs/ca/cert.pem --tlscert=/certs/client/cert.pem --tlskey=/certs/client/key.pem -H=tcp://localhost:2376"
+        (
+            _timing prefetch start
+            for image in {' '.join(prefetch_images)}
+            do
+                (
+                    $DIND image inspect $image &> /dev/null && exit 0
+                    if sudo -u ec2-user docker image inspect $image &> /dev/null
+                    then
+                        sudo -u ec2-user docker save $image | $DIND load
+                    else
+                        $DIND pull $image
+                    fi
+                ) &
+            done
+            wait
+            _timing prefetch end
+            cp /var/log/sdocker-timings.jsonl $CERTS/dockerd-logs/bootstrap-timings.jsonl
+        ) &
     fi
-    
+
+    _timing post-bootstrap start
     {post_bootstrap}
+    _timing post-bootstrap end
 
-    sleep 10
+    _timing boot end
     log_path=$(sudo -u ec2-user docker inspect dockerd-server | grep "LogPath" | sed 's/"LogPath": "//' | sed 's/",//')
     cp $log_path $CERTS/dockerd-logs/dockerd.log
     cp /var/log/user-data.log $CERTS/dockerd-logs/bootstrap.log
+    cp /var/log/sdocker-timings.jsonl $CERTS/dockerd-logs/bootstrap-timings.jsonl
+    [ -f /var/log/sdocker-docker-volume.json ] && cp /var/log/sdocker-docker-volume.json $CERTS/dockerd-logs/docker-volume.json
     chown -R {user_uid}:1001 $CERTS/dockerd-logs
 --//--"""
 
-    return bootstrap_script
\ No newline at end of file
+    return bootstrap_script
+
+def generate_bake_script(docker_images, bake_version):
+    """
+    User data for bake-ami builder instance: install bootstrap tooling, pull docker images,
+    mark the image as baked and shut down so the root volume can be imaged
+    """
+    bake_script = f"""#!/bin/bash
+set -x
+exec > >(tee /var/log/sdocker-bake.log|logger -t sdocker-bake -s 2>/dev/console) 2>&1
+
+    sudo yum install -y nfs-utils openssl
+    sudo systemctl enable docker
+    sudo systemctl start docker
+
+    for image in {' '.join(docker_images)}
+    do
+        sudo docker pull $image &
+    done
+    wait
+    sudo docker images
+
+    echo "{bake_version}" | sudo tee /etc/sdocker-baked
+    sudo cloud-init clean --logs
+    sudo shutdown -h now
+"""
+
+    return bake_script
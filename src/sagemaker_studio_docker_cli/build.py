@@ -0,0 +1,97 @@
+import os
+import shlex
+import logging as log
+
+# docker CLI image with buildx, run on the host next to the docker daemon
+builder_image = "docker:cli"
+builder_name = "sdocker"
+efs_cache_dir = ".sagemaker_studio_docker_cli/buildkit-cache"
+local_cache_volume = "sdocker-buildkit-cache"
+buildx_state_volume = "sdocker-buildx"
+# docker CLI config of the builder, outside of the home which is bind mounted read-only (and is /root in classic Studio)
+docker_config_dir = "/sdocker-docker"
+# rough throughput of `docker build` context upload from Studio to a host, only used to report time saved
+estimated_upload_rate = 50 * 1024 ** 2
+
+
+def check_under_home(path, home):
+    """
+    Build paths must be on the EFS home, which is the only part of Studio file system the host sees
+    """
+    path = os.path.realpath(path)
+    if path != home and not path.startswith(home.rstrip("/") + "/"):
+        message = f"{path} is not under {home}, the docker host only sees the EFS home folder"
+        log.error(message)
+        raise ValueError(message)
+    return path
+
+
+def context_size(path):
+    """
+    Total size in bytes of regular files in build context
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+                if not os.path.islink(os.path.join(root, name)):
+                    size += stat.st_size
+            except OSError:
+                pass
+    return size
+
+
+def build_command(context, dockerfile, tags, build_args, target, cache):
+    """
+    Shell command run in the builder container: copy client certificates to DOCKER_CONFIG where the docker CLI expects them,
+    create the buildx builder once (kept in buildx_state_volume) and build with local cache import/export
+    """
+    build = ["docker", "buildx", "build", "--builder", builder_name, "--load", "--progress", "plain", "-f", dockerfile]
+    for tag in tags:
+        build += ["-t", tag]
+    for build_arg in build_args:
+        build += ["--build-arg", build_arg]
+    if target:
+        build += ["--target", target]
+    if cache != "none":
+        build += ["--cache-from", "type=local,src=/cache", "--cache-to", "type=local,dest=/cache,mode=max"]
+    build.append(context)
+    return " && ".join([
+        f"mkdir -p {docker_config_dir}",
+        f"cp /certs/ca/cert.pem {docker_config_dir}/ca.pem",
+        f"cp /certs/client/cert.pem {docker_config_dir}/cert.pem",
+        f"cp /certs/client/key.pem {docker_config_dir}/key.pem",
+        f"(docker buildx inspect {builder_name} > /dev/null 2>&1 || docker buildx create --name {builder_name} --driver docker-container > /dev/null)",
+        shlex.join(build)
+    ])
+
+
+def builder_spec(home, cert_path, context, dockerfile, tags, build_args, target, cache):
+    """
+    POST /containers/create body of the builder container. It shares the network namespace of the docker
+    daemon so the daemon is reached on localhost, and bind mounts the EFS home so the context is read in place
+    """
+    binds = [
+        f"{home}:{home}:ro",
+        f"{cert_path.rstrip('/')}:/certs:ro",
+        f"{buildx_state_volume}:{docker_config_dir}/buildx"
+    ]
+    if cache == "efs":
+        binds.append(f"{home}/{efs_cache_dir}:/cache")
+    elif cache == "local":
+        binds.append(f"{local_cache_volume}:/cache")
+    return {
+        "Image": builder_image,
+        "Entrypoint": ["sh", "-c"],
+        "Cmd": [build_command(context, dockerfile, tags, build_args, target, cache)],
+        "Env": ["DOCKER_HOST=tcp://localhost:2376", "DOCKER_TLS_VERIFY=1", f"DOCKER_CONFIG={docker_config_dir}"],
+        "Tty": True,
+        "HostConfig": {"NetworkMode": "host", "Binds": binds}
+    }
+
+
+def format_upload_saved(size, build_time):
+    return f"Build context of {size / 1024 ** 2:.1f} MiB was read from EFS on the host, nothing uploaded " \
+        f"(~{size / estimated_upload_rate:.0f}s upload saved at {estimated_upload_rate // 1024 ** 2} MiB/s), " \
+        f"build took {build_time:.0f}s"
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import tempfile
+import logging as log
+
+
+def atomic_write_json(filename, data):
+    """
+    Write json data to a temporary file then move it into place, readers never see a partial file
+    """
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(data, tmp_file, indent=4, default=str)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def load_cache(filename):
+    """
+    Load all cache entries from file, missing or corrupted cache file is treated as empty
+    """
+    try:
+        with open(filename, "r") as cache_file:
+            data = json.load(cache_file)
+        if type(data) == dict:
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as error:
+        log.info(f"Ignoring unreadable cache file {filename}: {error}")
+    return {}
+
+
+def read_cache(filename, key, ttl=None, fingerprint=None):
+    """
+    Returns (value, age) of cache entry, (None, None) if entry is missing, expired or fingerprint changed
+    """
+    entry = load_cache(filename).get(key)
+    if not entry or "Timestamp" not in entry:
+        return (None, None)
+    age = time.time() - entry["Timestamp"]
+    if ttl is not None and (age > ttl or age < 0):
+        log.info(f"Cache entry {key} in {filename} expired ({int(age)}s old)")
+        return (None, None)
+    if fingerprint is not None and entry.get("Fingerprint") != fingerprint:
+        log.info(f"Cache entry {key} in {filename} invalidated, fingerprint changed")
+        return (None, None)
+    return (entry["Value"], age)
+
+
+def write_cache(filename, key, value, fingerprint=None):
+    """
+    Store value under key with current timestamp
+    """
+    data = load_cache(filename)
+    data[key] = {
+        "Timestamp": time.time(),
+        "Fingerprint": fingerprint,
+        "Value": value
+    }
+    atomic_write_json(filename, data)
+
+
+def invalidate_cache(filename, key=None):
+    """
+    Remove a single entry, or the whole cache file if key is not supplied
+    """
+    if key is None:
+        if os.path.exists(filename):
+            os.remove(filename)
+        return
+    data = load_cache(filename)
+    if key in data:
+        del data[key]
+        atomic_write_json(filename, data)
@@ -0,0 +1,130 @@
+import time
+import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from config import get_home, default_instance_catalog_ttl
+from cache import read_cache, write_cache
+
+# bump when catalog entry fields change, so older catalogs are fetched again
+catalog_version = "1"
+
+
+def get_catalog_filename():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/instance-catalog.json"
+
+
+def catalog_entry(instance_type_info, availability_zones):
+    """
+    Keep the ec2:DescribeInstanceTypes fields sdocker uses, in the same shape, with the availability zones offering it
+    """
+    entry = {
+        "InstanceType": instance_type_info["InstanceType"],
+        "CurrentGeneration": instance_type_info.get("CurrentGeneration", False),
+        "BareMetal": instance_type_info.get("BareMetal", False),
+        "BurstablePerformanceSupported": instance_type_info.get("BurstablePerformanceSupported", False),
+        "SupportedUsageClasses": instance_type_info.get("SupportedUsageClasses", []),
+        "ProcessorInfo": {"SupportedArchitectures": instance_type_info["ProcessorInfo"]["SupportedArchitectures"]},
+        "VCpuInfo": {"DefaultVCpus": instance_type_info["VCpuInfo"]["DefaultVCpus"]},
+        "MemoryInfo": {"SizeInMiB": instance_type_info["MemoryInfo"]["SizeInMiB"]},
+        "InstanceStorageSupported": instance_type_info.get("InstanceStorageSupported", False),
+        "AvailabilityZones": sorted(availability_zones)
+    }
+    if "InstanceStorageInfo" in instance_type_info.keys():
+        storage = instance_type_info["InstanceStorageInfo"]
+        entry["InstanceStorageInfo"] = {"TotalSizeInGB": storage["TotalSizeInGB"], "NvmeSupport": storage.get("NvmeSupport")}
+    if "GpuInfo" in instance_type_info.keys():
+        entry["GpuInfo"] = instance_type_info["GpuInfo"]
+    return entry
+
+
+def fetch_catalog(ec2_client):
+    """
+    All instance types of the region and their availability zone offerings, both paginated listings run concurrently
+    """
+    def describe_instance_types():
+        paginator = ec2_client.get_paginator("describe_instance_types")
+        return [info for page in paginator.paginate() for info in page["InstanceTypes"]]
+
+    def describe_offerings():
+        offerings = {}
+        paginator = ec2_client.get_paginator("describe_instance_type_offerings")
+        for page in paginator.paginate(LocationType="availability-zone"):
+            for offering in page["InstanceTypeOfferings"]:
+                offerings.setdefault(offering["InstanceType"], []).append(offering["Location"])
+        return offerings
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        instance_types = executor.submit(describe_instance_types)
+        offerings = executor.submit(describe_offerings)
+        instance_types, offerings = instance_types.result(), offerings.result()
+    return {
+        info["InstanceType"]: catalog_entry(info, offerings.get(info["InstanceType"], []))
+        for info in instance_types
+    }
+
+
+def load_catalog(ec2_client, region, ttl=default_instance_catalog_ttl, refresh=False):
+    """
+    Instance type catalog of region, {instance type: catalog entry}. The catalog is cached per region for
+    ttl seconds, only an expired, missing or refreshed catalog makes API calls.
+    """
+    cache_filename = get_catalog_filename()
+    if not refresh:
+        catalog, age = read_cache(cache_filename, region, ttl, catalog_version)
+        if catalog:
+            log.info(f"Using cached instance type catalog of {region} ({len(catalog)} types, {int(age)}s old)")
+            return catalog
+    start = time.perf_counter()
+    catalog = fetch_catalog(ec2_client)
+    log.info(f"Fetched instance type catalog of {region} ({len(catalog)} types) in {time.perf_counter() - start:.1f}s")
+    try:
+        write_cache(cache_filename, region, catalog, catalog_version)
+    except Exception as error:
+        log.error(f"Failed to write instance type catalog: {error}")
+    return catalog
+
+
+def gpu_count(entry):
+    return sum(gpu.get("Count", 0) for gpu in entry.get("GpuInfo", {}).get("Gpus", []))
+
+
+def select_instance_type(catalog, availability_zones, cpus=None, memory=None, gpus=None):
+    """
+    Smallest x86_64 on-demand instance type offered in one of availability_zones with at least cpus vCPUs,
+    memory GiB and gpus GPUs. GPU types are only picked when GPUs are requested, bare metal and burstable
+    types are left out. Current generation types come first, then fewest GPUs, then smallest size where
+    4 GiB of memory weighs as much as one vCPU (the general purpose ratio, a rough proxy for price).
+    """
+    availability_zones = set(availability_zones)
+    candidates = [
+        entry for entry in catalog.values()
+        if "x86_64" in entry["ProcessorInfo"]["SupportedArchitectures"]
+        and "on-demand" in entry["SupportedUsageClasses"]
+        and not entry["BareMetal"]
+        and not entry["BurstablePerformanceSupported"]
+        and availability_zones.intersection(entry["AvailabilityZones"])
+        and entry["VCpuInfo"]["DefaultVCpus"] >= (cpus or 0)
+        and entry["MemoryInfo"]["SizeInMiB"] >= (memory or 0) * 1024
+        and (gpu_count(entry) >= gpus if gpus else gpu_count(entry) == 0)
+    ]
+    if len(candidates) == 0:
+        raise ValueError(
+            f"No instance type with {cpus or 0} vCPUs, {memory or 0} GiB memory and {gpus or 0} GPUs "
+            f"is offered in {sorted(availability_zones)}"
+        )
+    return min(candidates, key=lambda entry: (
+        not entry["CurrentGeneration"],
+        gpu_count(entry),
+        entry["VCpuInfo"]["DefaultVCpus"] + entry["MemoryInfo"]["SizeInMiB"] / 4096,
+        entry["VCpuInfo"]["DefaultVCpus"],
+        entry["InstanceType"]
+    ))
+
+
+def format_instance_type(entry):
+    description = f"{entry['InstanceType']} ({entry['VCpuInfo']['DefaultVCpus']} vCPUs, " \
+        f"{entry['MemoryInfo']['SizeInMiB'] / 1024:g} GiB memory"
+    if gpu_count(entry):
+        description += f", {gpu_count(entry)} GPUs"
+    if "InstanceStorageInfo" in entry.keys():
+        description += f", {entry['InstanceStorageInfo']['TotalSizeInGB']} GB instance store"
+    return description + ")"
@@ -0,0 +1,144 @@
+import os
+import fcntl
+import shutil
+import tempfile
+import subprocess
+import logging as log
+from config import get_home
+
+ca_valid_days = 3650
+cert_valid_days = 825
+renew_before_days = 30
+
+
+def get_tls_dir():
+    """
+    Long-lived per-user CA and client certificate shared by all hosts
+    """
+    return f"{get_home()}/.sagemaker_studio_docker_cli/tls"
+
+
+def run_openssl(*args):
+    result = subprocess.run(["openssl", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        message = f"openssl {args[0]} failed: {result.stderr.decode().strip()}"
+        log.error(message)
+        raise RuntimeError(message)
+    return result.stdout
+
+
+def generate_key(path):
+    """
+    ECDSA P-256 private key, orders of magnitude faster to generate than 4096-bit RSA
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    run_openssl("genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256", "-out", path)
+    os.chmod(path, 0o600)
+
+
+def cert_needs_renewal(path):
+    """
+    True when certificate is missing or expires within renew_before_days
+    """
+    if not os.path.exists(path):
+        return True
+    result = subprocess.run(
+        ["openssl", "x509", "-checkend", str(renew_before_days * 86400), "-noout", "-in", path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    return result.returncode != 0
+
+
+def sign(tls_dir, key_path, cert_path, subject, extensions):
+    """
+    Sign a certificate for key_path with the user CA
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csr_path = os.path.join(tmp_dir, "csr.pem")
+        ext_path = os.path.join(tmp_dir, "openssl.cnf")
+        with open(ext_path, "w") as ext_file:
+            ext_file.write("[ x509_exts ]\n" + "\n".join(extensions) + "\n")
+        run_openssl("req", "-new", "-key", key_path, "-out", csr_path, "-subj", subject)
+        run_openssl(
+            "x509", "-req",
+            "-in", csr_path,
+            "-CA", f"{tls_dir}/ca/cert.pem",
+            "-CAkey", f"{tls_dir}/ca/key.pem",
+            "-CAcreateserial", "-CAserial", f"{tls_dir}/ca/serial",
+            "-out", cert_path,
+            "-days", str(cert_valid_days),
+            "-extfile", ext_path,
+            "-extensions", "x509_exts"
+        )
+
+
+def ensure_user_certs():
+    """
+    Create (or renew) the user CA and the client certificate, keys are kept when renewing so
+    certificates issued before stay valid
+    """
+    tls_dir = get_tls_dir()
+    os.makedirs(f"{tls_dir}/ca", exist_ok=True)
+    os.makedirs(f"{tls_dir}/client", exist_ok=True)
+    with open(f"{tls_dir}/.lock", "a") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(f"{tls_dir}/ca/key.pem"):
+                generate_key(f"{tls_dir}/ca/key.pem")
+            if cert_needs_renewal(f"{tls_dir}/ca/cert.pem"):
+                log.info("Creating sdocker CA certificate")
+                run_openssl(
+                    "req", "-new", "-x509",
+                    "-key", f"{tls_dir}/ca/key.pem",
+                    "-out", f"{tls_dir}/ca/cert.pem",
+                    "-days", str(ca_valid_days),
+                    "-subj", "/CN=sdocker CA",
+                    "-addext", "basicConstraints=critical,CA:TRUE",
+                    "-addext", "keyUsage=critical,keyCertSign,cRLSign"
+                )
+            if not os.path.exists(f"{tls_dir}/client/key.pem"):
+                generate_key(f"{tls_dir}/client/key.pem")
+            if cert_needs_renewal(f"{tls_dir}/client/cert.pem"):
+                log.info("Creating sdocker client certificate")
+                sign(
+                    tls_dir,
+                    f"{tls_dir}/client/key.pem",
+                    f"{tls_dir}/client/cert.pem",
+                    "/CN=docker:dind client",
+                    ["extendedKeyUsage = clientAuth"]
+                )
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN)
+    return tls_dir
+
+
+def write_host_certs(home, instance_type, instance_id, dns, ip_address):
+    """
+    Issue server certificate of a host and write it, with CA and client certificates, to the host
+    certificates folder on EFS where the bootstrap script waits for it
+    """
+    tls_dir = ensure_user_certs()
+    certs_dir = f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/certs"
+    for folder in ["ca", "client", "server"]:
+        os.makedirs(f"{certs_dir}/{folder}", exist_ok=True)
+    shutil.copyfile(f"{tls_dir}/ca/cert.pem", f"{certs_dir}/ca/cert.pem")
+    shutil.copyfile(f"{tls_dir}/client/cert.pem", f"{certs_dir}/client/cert.pem")
+    shutil.copyfile(f"{tls_dir}/client/key.pem", f"{certs_dir}/client/key.pem")
+    shutil.copyfile(f"{tls_dir}/ca/cert.pem", f"{certs_dir}/server/ca.pem")
+    # write server key and certificate under temporary names, bootstrap starts dockerd once cert.pem exists
+    generate_key(f"{certs_dir}/server/.key.pem")
+    sign(
+        tls_dir,
+        f"{certs_dir}/server/.key.pem",
+        f"{certs_dir}/server/.cert.pem",
+        "/CN=docker:dind server",
+        [
+            f"subjectAltName = DNS:{dns},IP:{ip_address},DNS:localhost,DNS:docker,IP:127.0.0.1",
+            "extendedKeyUsage = serverAuth"
+        ]
+    )
+    os.replace(f"{certs_dir}/server/.key.pem", f"{certs_dir}/server/key.pem")
+    os.replace(f"{certs_dir}/server/.cert.pem", f"{certs_dir}/server/cert.pem")
+    log.info(f"Wrote certificates for {instance_id} to {certs_dir}")
+    return certs_dir
@@ -1,205 +1,358 @@
-import botocore
 import logging as log
-import boto3
-import requests
 import json
 import time
 import os
-from config import get_home, ReadFromFile, UnhandledError
-from bootstrap import generate_bootstrap_script
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import get_home, ReadFromFile, UnhandledError, InvalidateConfigCache, UpdateConfigCache, \
+    get_snapshot_docker_volume
+from bootstrap import generate_bootstrap_script, generate_bake_script, mirror_image
+from discovery import format_timings
+from ami import resolve_image_id, get_architecture, get_image_cache_filename
+from cache import invalidate_cache, load_cache, atomic_write_json
+from readiness import HostReadiness, timeout
+from hosts import HostRegistry
+from docker_api import get_client, benchmark, get_cert_path
+from launch import plan_subnets, launch_with_fallback, LaunchError
+from timings import record_launch, load_launches, format_report
+from certs import write_host_certs
+from volumes import attach_volume, snapshot_volumes
+from security_groups import resolve_security_groups
+from contexts import create_context, remove_contexts, list_contexts, use_context, context_exists, \
+    current_context, get_context_name, default_context
+from catalog import load_catalog, select_instance_type, format_instance_type
+from watcher import start_watcher, write_watch_status, read_watch_status, format_watch_status
+from idle import read_idle_status, format_idle, write_idle_monitor
+from build import builder_image, builder_spec, check_under_home, context_size, efs_cache_dir, format_upload_saved
 
-log_cmd = f" &>> {get_home()}/.sagemaker_studio_docker_cli/sdocker.log"
 retry_wait = 5
-timeout = 720
-max_retries = 720 // retry_wait
-
-def ping_host(home, instance_type, instance_id, dns, port, retry=True):
-    """
-    Check Docker host health by requesting /version from docker daemon on host
-    """
-    try:
-        log.info(f"Pinging {dns}")
-        path_to_cert = f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/certs/"
-        cert=(path_to_cert + "client/cert.pem", path_to_cert + "client/key.pem")
-        response = json.loads(requests.get(f"https://{dns}:{port}/version", cert=cert, verify=path_to_cert + "ca/cert.pem").content.decode("utf-8"))
-        log.info(f"DockerHost {dns} is healthy!")
-        return (True, None)
-    except Exception as error:
-        if retry:
-            log.error(f"Failed to reach {dns}:{port}, retrying in {retry_wait}s")
-        else:
-            log.error(f"Failed to reach {dns}:{port}, with error message {error.message}")
-        return (False, error)
-
+max_retries = timeout // retry_wait
+pool_stats_samples = 50
+progress_interval = 30
 
 class Commands():
     """
     Class for sagemaker_studio_docker_cli commands
     """
-    def __init__(self, args, config):
+    # Configuration fields needed by each command, None requires the full discovered configuration
+    required_config = {
+        "create-host": None,
+        "terminate-current-host": ["Region"],
+        "terminate-host": ["Region"],
+        "config": None,
+        "pool": None,
+        "stop-host": ["Region"],
+        "start-host": None,
+        "list-hosts": ["Region"],
+        "use-host": ["Region"],
+        "describe-host": ["Region"],
+        "ping-host": ["Region"],
+        "bake-ami": None,
+        "timings": ["Region"],
+        "build": ["Region"],
+        "wait": ["Region"],
+        "watch-host": None
+    }
+
+    def __init__(self, args, config, ec2_client=None, registry=None):
         """
-        Create ec2 client and passes args and config
+        Passes args and config, the agent passes its warm ec2 client and host registry
         """
         commands = {
             "create-host": self.create_host,
             "terminate-current-host": self.terminate_current_host,
-            "terminate-host": self.terminate_host
+            "terminate-host": self.terminate_host,
+            "config": self.show_config,
+            "pool": self.pool,
+            "stop-host": self.stop_host,
+            "start-host": self.start_host,
+            "list-hosts": self.list_hosts,
+            "use-host": self.use_host,
+            "describe-host": self.describe_host,
+            "ping-host": self.ping_host,
+            "bake-ami": self.bake_ami,
+            "timings": self.timings,
+            "build": self.build,
+            "wait": self.wait,
+            "watch-host": self.watch_host
         }
-        self.ec2_client = boto3.client("ec2", region_name=config["Region"])
+        self._ec2_client = ec2_client
+        self.registry = registry or HostRegistry()
+        self.security_groups = None
+        self.catalog = None
+        self.launch_details = {}
+        self.volume_lock = threading.Lock()
+        self.phase_timings = {}
         self.args = args
         self.config = config
         commands[self.args.func]()
 
+    @property
+    def ec2_client(self):
+        """
+        EC2 client created on first use, commands making no EC2 calls (eg. timings, wait, build) never import boto3
+        """
+        if self._ec2_client is None:
+            import boto3
+            self._ec2_client = boto3.client("ec2", region_name=self.config["Region"])
+        return self._ec2_client
+
 
-    def create_sg(self, name, desc, source_sg, from_port, to_port, revoke_egress=False):
+    def show_config(self):
         """
-        Creates security group if not found in VPC
+        Show resolved configuration, `config refresh` is handled by ReadConfig(refresh=True)
         """
-        sg_exist = False
-        log.info(f"Checking {name} security group exists")
-        try:
-            check_response= self.ec2_client.describe_security_groups(
-                Filters=[
-                    {
-                        "Name": "group-name",
-                        "Values": [name]
-                    },
-                    {
-                        "Name": "vpc-id",
-                        "Values": [self.config["VpcId"]]
-                    }
-                ]
-            )
-            if len(check_response['SecurityGroups']) > 0:
-                sg_exist = True
-                log.info(f"Found {name} security group {check_response['SecurityGroups'][0]['GroupId']}")
-            else:
-                log.info(f"Security group {name} not found")
-        except botocore.exceptions.ClientError as error:
-            if error.response["Error"]["Code"] == "InvalidGroup.NotFound":
-                log.info(f"Security group {name} not found, 'ClientError' was raised")
-                sg_exist = False
+        if self.args.action == "show":
+            print(json.dumps(self.config, indent=4, default=str))
+        else:
+            log.info("Configuration refreshed")
+            print("Configuration refreshed")
+            if "DiscoveryTimings" in self.config.keys():
+                print(format_timings(self.config["DiscoveryTimings"]))
+
+
+    def prepare_efs(self, sg, availability_zones):
+        """
+        Adds security group to the EFS mount targets used by hosts in availability_zones: the mount target of their
+        availability zone, or the default mount target when there is none. Membership is checked against the
+        discovered (cached) mount target groups, so no API call is made once the group was added. Otherwise the
+        live groups are read first, modify_mount_target_security_groups replaces the whole set
+        """
+        mount_targets = self.config["MountTargets"]
+        targets = {}
+        for availability_zone in availability_zones:
+            if availability_zone in mount_targets:
+                targets[availability_zone] = mount_targets[availability_zone]
             else:
-                UnhandledError(error)
-        except Exception as error:
-            UnhandledError(error)
-                
-        if not sg_exist:
-            log.info(f"Creating {name} security group")
+                default_zone = [zone for zone, target in mount_targets.items() if target["MountTargetId"] == self.config["MountTargetId"]][0]
+                targets[default_zone] = mount_targets[default_zone]
+        changed = False
+        efs_client = None
+        for availability_zone, target in targets.items():
+            if sg in target["SecurityGroups"]:
+                continue
             try:
-                response = self.ec2_client.create_security_group(
-                    Description=desc,
-                    GroupName=name,
-                    VpcId=self.config["VpcId"]
-                )
-                if revoke_egress:
-                    revoke_response = self.ec2_client.revoke_security_group_egress(
-                        GroupId=response["GroupId"],
-                        IpPermissions=[
-                            {
-                                "IpProtocol": "-1",
-                                "IpRanges": [
-                                    {
-                                        "CidrIp": "0.0.0.0/0"
-                                    }
-                                ]
-                            }
-                        ]
+                if efs_client is None:
+                    import boto3
+                    efs_client = boto3.client("efs", region_name=self.config["Region"])
+                security_groups = efs_client.describe_mount_target_security_groups(
+                    MountTargetId=target["MountTargetId"]
+                )["SecurityGroups"]
+                if sg not in security_groups:
+                    log.info(f"Adding {sg} to EFS mount target {target['MountTargetId']} in {availability_zone}")
+                    security_groups = [*security_groups, sg]
+                    efs_client.modify_mount_target_security_groups(
+                        MountTargetId=target["MountTargetId"],
+                        SecurityGroups=security_groups
                     )
-                    rule_response = self.ec2_client.authorize_security_group_egress(
-                    GroupId=response["GroupId"],
-                        IpPermissions=[
-                            {
-                                "FromPort": from_port,
-                                "IpProtocol": 'tcp',
-                                "ToPort": to_port,
-                                "UserIdGroupPairs": [
-                                    {
-                                        "Description": desc,
-                                        "GroupId": response["GroupId"] if source_sg=="self" else source_sg,
-                                    },
-                                ],
-                            },
-                        ]
-                    )
-                rule_response = self.ec2_client.authorize_security_group_ingress(
-                    GroupId=response["GroupId"],
-                    IpPermissions=[
-                        {
-                            "FromPort": from_port,
-                            "IpProtocol": 'tcp',
-                            "ToPort": to_port,
-                            "UserIdGroupPairs": [
-                                {
-                                    "Description": desc,
-                                    "GroupId": response["GroupId"] if source_sg=="self" else source_sg,
-                                },
-                            ],
-                        },
-                    ]
-                )                
-                log.info(f"Security Group id: {response['GroupId']}")
-            except botocore.exceptions.ClientError as error:
-                if error.response["Error"]["Code"] != "InvalidGroup.Duplicate":
-                    UnhandledError(error)
             except Exception as error:
                 UnhandledError(error)
-            sg = response["GroupId"]
-        else:
-            sg = check_response['SecurityGroups'][0]["GroupId"]
-        return sg
+            target["SecurityGroups"] = security_groups
+            changed = True
+        if changed:
+            UpdateConfigCache(self.config, {"MountTargets": mount_targets})
 
+    def terminate_instances(self, instance_ids):
+        """
+        Terminate hosts with a single terminate_instances call, then remove their docker contexts and
+        registry entries in one pass. Ids of instances that no longer exist are only cleaned up locally
+        """
+        self.snapshot_docker_volumes(instance_ids)
+        try:
+            try:
+                self.ec2_client.terminate_instances(InstanceIds=instance_ids)
+            except self.ec2_client.exceptions.ClientError as error:
+                if error.response["Error"]["Code"] not in ["InvalidInstanceID.NotFound", "InvalidInstanceID.Malformed"]:
+                    raise
+                # the whole call is rejected when one id is unknown, retry with the instances that exist
+                existing = [instance["InstanceId"] for instance in self.describe_owned_instances(instance_ids, owned=False)]
+                log.info(f"Some of {instance_ids} do not exist, terminating {existing}")
+                if existing:
+                    self.ec2_client.terminate_instances(InstanceIds=existing)
+        except Exception as error:
+            UnhandledError(error)
+        finally:
+            self.remove_host_contexts(instance_ids)
+            self.registry.remove_hosts(instance_ids)
 
-    def prepare_efs(self, sg):
+    def describe_owned_instances(self, instance_ids=None, owned=True):
         """
-        Adds mount target to EFS
+        Live instances owned by current user with one paginated describe_instances call, optionally limited to instance_ids
         """
-        if sg not in self.config["MountTargetSecurityGroups"]:
+        filters = [{"Name": "instance-state-name", "Values": ["pending", "running", "stopping", "stopped"]}]
+        if owned:
+            filters.append({"Name": "tag:sdocker:Owner", "Values": [self.owner_tag()["Value"]]})
+        if instance_ids:
+            filters.append({"Name": "instance-id", "Values": instance_ids})
+        instances = []
+        paginator = self.ec2_client.get_paginator("describe_instances")
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page["Reservations"]:
+                instances.extend(reservation["Instances"])
+        return instances
+
+    def terminate_host(self):
+        """
+        Terminate hosts by instance id, --all terminates every host of the user (registered or found by owner tag),
+        --stale terminates hosts of the user missing from the registry and drops registry entries of instances
+        that no longer exist. Warm pool instances are left to the pool command, bake-ami builders to bake-ami
+        """
+        instance_ids = [*self.args.instance_ids, *self.args.instance_id]
+        removed = []
+        if self.args.all or self.args.stale:
+            registered = [host["InstanceId"] for host in self.registry.hosts()]
             try:
-                response = self.config["EFSClient"].modify_mount_target_security_groups(
-                    MountTargetId=self.config["MountTargetId"],
-                    SecurityGroups=[*self.config["MountTargetSecurityGroups"], sg]
-                )
+                owned = [
+                    instance["InstanceId"] for instance in self.describe_owned_instances()
+                    if not {"sdocker:Pool", "sdocker:Builder"}.intersection(tag["Key"] for tag in instance.get("Tags", []))
+                ]
+                # registered hosts may lack the owner tag (eg. created by older versions), look them up by id
+                existing = [
+                    instance["InstanceId"] for instance in self.describe_owned_instances(registered, owned=False)
+                ] if self.args.stale and registered else []
             except Exception as error:
                 UnhandledError(error)
-    
-    def terminate_host(self):
+            if self.args.all:
+                instance_ids += registered + owned
+            if self.args.stale:
+                instance_ids += [instance_id for instance_id in owned if instance_id not in registered]
+                removed = [instance_id for instance_id in registered if instance_id not in existing]
+        instance_ids = list(dict.fromkeys(instance_ids))
+        if removed:
+            self.remove_host_contexts(removed)
+            self.registry.remove_hosts(removed)
+            print(f"Removed {len(removed)} hosts that no longer exist from sdocker-hosts.conf: {' '.join(removed)}")
+        if len(instance_ids) == 0:
+            if not removed:
+                print("No hosts to terminate")
+            return
+        self.terminate_instances(instance_ids)
+        print(f"Successfully terminated {len(instance_ids)} instance(s): {' '.join(instance_ids)}")
+        log.info(f"Successfully terminated instances {instance_ids}")
+
+    def terminate_current_host(self, instance_id=None):
+        """
+        Terminate Docker Host command, terminates current host unless instance_id is supplied
+        """
+        if instance_id:
+            host = self.registry.get_host(instance_id)
+        else:
+            host = self.registry.current_host()
+            if not host:
+                message = "No current host found in sdocker-hosts.conf"
+                log.error(message)
+                raise ValueError(message)
+            instance_id = host["InstanceId"]
+        self.terminate_instances([instance_id])
+        instance_dns = host["InstanceDns"] if host else "unknown"
+        print(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
+        log.info(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
+
+    def remove_host_contexts(self, instance_ids):
+        """
+        Remove docker contexts of hosts, switching to the default context if one of them is current
+        """
+        names = [name for name in list_contexts() if any(name.endswith(f"_{instance_id}") for instance_id in instance_ids)]
+        try:
+            remove_contexts(names)
+        except Exception as error:
+            log.error(f"Failed to remove docker contexts {names}: {error}")
+
+    def snapshot_docker_volumes(self, instance_ids):
+        """
+        Snapshot docker data volumes of hosts about to be terminated when SnapshotDockerVolume is set,
+        so the docker cache can be restored in any availability zone
+        """
+        if not get_snapshot_docker_volume():
+            return
+        try:
+            snapshot_ids = snapshot_volumes(self.ec2_client, self.owner_tag(), instance_ids)
+        except Exception as error:
+            log.error(f"Failed to snapshot docker data volumes of {instance_ids}: {error}")
+            return
+        if snapshot_ids:
+            print(f"Creating docker data snapshots: {' '.join(snapshot_ids)}")
+
+    def list_hosts(self):
+        """
+        List registered hosts with their instance state, current host is marked with *
+        """
+        try:
+            hosts = self.registry.refresh(self.ec2_client, force=self.args.refresh)
+        except Exception as error:
+            UnhandledError(error)
+        current = self.registry.read()["CurrentHost"]
+        if len(hosts) == 0:
+            print("No hosts registered")
+            return
+        print(f"  {'INSTANCE ID':<20} {'INSTANCE TYPE':<15} {'STATE':<10} {'PRIVATE DNS':<45} IDLE SHUTDOWN")
+        for host in hosts:
+            marker = "*" if host["InstanceId"] == current else " "
+            state = "booting" if host.get("Ready") is False and host.get("State") in ["pending", "running"] else host.get("State", "unknown")
+            idle = format_idle(read_idle_status(get_home(), host["InstanceType"], host["InstanceId"]), host.get("State"))
+            print(f"{marker} {host['InstanceId']:<20} {host['InstanceType']:<15} {state:<10} {host['InstanceDns']:<45} {idle}")
+
+    def use_host(self):
+        """
+        Make a registered host the current host and switch docker context to it
+        """
         instance_id = self.args.instance_id
+        host = self.registry.get_host(instance_id)
+        if not host:
+            message = f"Host {instance_id} is not registered, see sdocker list-hosts"
+            log.error(message)
+            raise ValueError(message)
+        self.registry.set_current(instance_id)
+        context = get_context_name(host["InstanceType"], instance_id)
         try:
-            response = self.ec2_client.terminate_instances(
-                InstanceIds=[instance_id]
-            )
+            if not context_exists(context):
+                self.create_host_context(host)
+            use_context(context)
         except Exception as error:
             UnhandledError(error)
-        finally:
-            log.info("Running OS level command:")            
-            os.system(f"docker context use default" + log_cmd)
-            os.system(f'docker context rm `docker context list -q | grep "{instance_id}"`' + log_cmd)
+        print(f"Current host is now {instance_id} ({host['InstanceDns']})")
 
+    def ping_host(self):
+        """
+        Benchmark docker daemon latency of a registered host: first /_ping includes TCP and TLS handshake,
+        following pings reuse the kept-alive connection. Defaults to current host
+        """
+        host = self.registry.get_host(self.args.instance_id) if self.args.instance_id else self.registry.current_host()
+        if not host:
+            message = "Host not found in sdocker-hosts.conf"
+            log.error(message)
+            raise ValueError(message)
+        client = get_client(get_home(), host["InstanceType"], host["InstanceId"], host["InstanceDns"], host["Port"])
+        try:
+            first, keep_alive = benchmark(client, self.args.count)
+        except Exception as error:
+            UnhandledError(error)
+        print(f"Host {host['InstanceId']} ({host['InstanceDns']}:{host['Port']})")
+        print(f"First ping (with handshake): {first * 1000:.1f}ms")
+        if keep_alive:
+            print(f"Keep-alive pings: median {sorted(keep_alive)[len(keep_alive) // 2] * 1000:.1f}ms, max {max(keep_alive) * 1000:.1f}ms over {len(keep_alive)} pings")
 
-    def terminate_current_host(self, instance_id=None):
+    def describe_host(self):
         """
-        Terminate Docker Host command
+        Show registry entry and live EC2 details of a host, defaults to current host
         """
-        home = get_home()
-        sdocker_host_filename = f"{home}/.sagemaker_studio_docker_cli/sdocker-hosts.conf"
+        host = self.registry.get_host(self.args.instance_id) if self.args.instance_id else self.registry.current_host()
+        if not host:
+            message = "Host not found in sdocker-hosts.conf"
+            log.error(message)
+            raise ValueError(message)
         try:
-            if not instance_id:
-                sdocker_host_config = ReadFromFile(sdocker_host_filename)
-                instance_id = sdocker_host_config["ActiveHosts"][0]["InstanceId"]
-            response = self.ec2_client.terminate_instances(
-                InstanceIds=[instance_id]
-            )
+            instance = self.ec2_client.describe_instances(InstanceIds=[host["InstanceId"]])["Reservations"][0]["Instances"][0]
         except Exception as error:
             UnhandledError(error)
-        finally:
-            log.info("Running OS level command:")             
-            os.system(f"docker context use default" + log_cmd)
-            os.system(f'docker context rm `docker context list -q | grep "{instance_id}"`' + log_cmd)
-        instance_id = sdocker_host_config["ActiveHosts"][0]["InstanceId"]
-        instance_dns = sdocker_host_config["ActiveHosts"][0]["InstanceDns"]
-        print(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
-        log.info(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
+        host["State"] = instance["State"]["Name"]
+        host["LaunchTime"] = instance["LaunchTime"]
+        host["SubnetId"] = instance.get("SubnetId")
+        host["AvailabilityZone"] = instance["Placement"]["AvailabilityZone"]
+        idle_status = read_idle_status(get_home(), host["InstanceType"], host["InstanceId"])
+        if idle_status:
+            host["Idle"] = {**idle_status, "Shutdown": format_idle(idle_status, host["State"])}
+        print(json.dumps(host, indent=4, default=str))
 
     def read_custom_script(self, script_path):
         with open(script_path, "rb") as script:
@@ -209,51 +362,127 @@ class Commands():
 
             return b"".join(readlines).decode().replace("\n", "\n    ")
 
-    def create_host(self):
+    def get_subnet_id(self):
         """
-        Create Docker Host command
+        Subnet used for new hosts, --subnet-id must be one of SageMaker Studio domain subnets
         """
-        home = get_home()
-        port = self.config["Port"]
-        if self.args.subnet_id:
-            if self.args.subnet_id in self.config["SubnetIds"]:
-                self.config["SubnetId"] = self.args.subnet_id
-            else:
-                message = f"InvalidSubnetId: {self.args.subnet_id} is either invalid subnet id or not part of {self.config['VpcId']}"
-                log.error(message)
-                raise ValueError(message)
+        subnet_id = getattr(self.args, "subnet_id", None)
+        if subnet_id:
+            if subnet_id in self.config["SubnetIds"]:
+                return subnet_id
+            message = f"InvalidSubnetId: {subnet_id} is either invalid subnet id or not part of {self.config['VpcId']}"
+            log.error(message)
+            raise ValueError(message)
+        return self.config["SubnetIds"][0]
+
+    def owner_tag(self):
+        return {"Key": "sdocker:Owner", "Value": f"{self.config['DomainId']}/{self.config['UserProfile']}"}
+
+    def prepare_network(self):
+        """
+        Prepare security groups and EFS mount target once per command, returns list of security group ids
+        """
+        if self.security_groups:
+            return self.security_groups
+        start = time.perf_counter()
+        groups = {}
+        if len(self.config["HostSGs"]) == 0:
+            groups["DockerHost"] = ("Docker host security group", self.config["SecurityGroups"][0], 0, 65535, False)
+        groups["EFSDockerHost"] = ("EFS security group used with Docker host", "self", 2049, 2049, True)
+        group_ids = self.config.get("ResolvedSecurityGroups") or {}
+        if all(name in group_ids for name in groups):
+            log.info(f"Using cached security groups {group_ids}")
+        else:
+            try:
+                group_ids = {**group_ids, **resolve_security_groups(self.ec2_client, self.config["VpcId"], groups)}
+            except Exception as error:
+                UnhandledError(error)
+            self.config["ResolvedSecurityGroups"] = group_ids
+            UpdateConfigCache(self.config, {"ResolvedSecurityGroups": group_ids})
+        docker_sg = self.config["HostSGs"] if len(self.config["HostSGs"]) > 0 else [group_ids["DockerHost"]]
+        efs_sg = group_ids["EFSDockerHost"]
+        if getattr(self.args, "subnet_id", None):
+            availability_zones = [self.config["SubnetAzs"][self.get_subnet_id()]]
+        else:
+            availability_zones = sorted(set(self.config["SubnetAzs"].values()))
+        self.prepare_efs(efs_sg, availability_zones)
+        self.security_groups = docker_sg + [efs_sg]
+        self.phase_timings["SecurityGroups"] = round(time.perf_counter() - start, 3)
+        return self.security_groups
+
+    def get_catalog(self, refresh=False):
+        """
+        Instance type catalog of the region, read from its local cache once per command
+        """
+        if self.catalog is None or refresh:
+            try:
+                self.catalog = load_catalog(
+                    self.ec2_client,
+                    self.config["Region"],
+                    self.config["InstanceCatalogTTL"],
+                    refresh or getattr(self.args, "refresh_config", False)
+                )
+            except Exception as error:
+                UnhandledError(error)
+        return self.catalog
+
+    def describe_instance_types(self, instance_types):
+        """
+        Catalog entries of requested instance types, the catalog is fetched again once when a type is missing
+        (eg. an instance type released after the catalog was cached)
+        """
+        missing = [instance_type for instance_type in instance_types if instance_type not in self.get_catalog()]
+        if missing:
+            log.info(f"Instance types {missing} not in cached catalog, refreshing it")
+            missing = [instance_type for instance_type in missing if instance_type not in self.get_catalog(refresh=True)]
+        if missing:
+            message = f"Instance types {missing} are not available in {self.config['Region']}"
+            log.error(message)
+            raise ValueError(message)
+        return {instance_type: self.catalog[instance_type] for instance_type in instance_types}
+
+    def pick_instance_type(self):
+        """
+        Smallest instance type matching --cpus, --memory and --gpus offered in the --subnet-id or domain
+        availability zones, picked from the cached catalog
+        """
+        if getattr(self.args, "subnet_id", None):
+            availability_zones = [self.config["SubnetAzs"][self.get_subnet_id()]]
         else:
-            self.config["SubnetId"] = self.config["SubnetIds"][0]
-        
-        docker_sg = self.config["HostSGs"]
-        if len(docker_sg) == 0:
-            docker_sg = [self.create_sg(
-                "DockerHost",
-                "Docker host security group",
-                self.config["SecurityGroups"][0],
-                0,
-                65535
-            )]
-        efs_sg = self.create_sg(
-            "EFSDockerHost",
-            "EFS security group used with Docker host",
-            "self",
-            2049,
-            2049,
-            revoke_egress=True
+            availability_zones = self.config["SubnetAzs"].values()
+        entry = select_instance_type(
+            self.get_catalog(),
+            availability_zones,
+            self.args.cpus,
+            self.args.memory,
+            self.args.gpus
         )
-        self.prepare_efs(efs_sg)
+        print(f"Selected {format_instance_type(entry)}")
+        log.info(f"Selected {entry['InstanceType']} for {self.args.cpus} vCPUs, {self.args.memory} GiB, {self.args.gpus} GPUs")
+        return entry["InstanceType"]
+
+    def prepare_launch(self, instance_type):
+        """
+        Prepare security groups, EFS and run_instances arguments (without counts) for instance type
+        """
+        home = get_home()
+        port = self.config["Port"]
+        self.config["SubnetId"] = self.get_subnet_id()
+        security_groups = self.prepare_network()
         docker_image_name = self.config["DockerImageURI"]
         gpu_option = ""
-        if "GpuInfo" in self.ec2_client.describe_instance_types(InstanceTypes=[self.args.instance_type])['InstanceTypes'][0].keys():
+        instance_type_info = self.describe_instance_types([instance_type])[instance_type]
+        if "GpuInfo" in instance_type_info.keys():
             # https://stackoverflow.com/a/71866959/18516713
             docker_image_name = self.config["DockerImageNvidiaURI"]
             gpu_option = "--gpus all"
+        instance_store = self.config["UseInstanceStore"] and not getattr(self.args, "no_instance_store", False) \
+            and has_nvme_instance_store(instance_type_info)
+        if instance_store:
+            storage = instance_type_info["InstanceStorageInfo"]
+            log.info(f"Using {storage['TotalSizeInGB']} GB NVMe instance store of {instance_type} as docker data-root")
 
         pre_bootstrap_script = self.read_custom_script(f"{home}/.sagemaker_studio_docker_cli/pre-bootstrap.sh")
-        create_certs = self.read_custom_script(
-            f"{home}/sagemaker-studio-docker-cli-extension/src/sagemaker_studio_docker_cli/create_certs.sh"
-        )
         post_bootstrap_script = self.read_custom_script(f"{home}/.sagemaker_studio_docker_cli/post-bootstrap.sh")
         additional_ports = self.config["AdditionalPorts"]
 
@@ -266,20 +495,37 @@ class Commands():
             docker_image_name, 
             pre_bootstrap_script, 
             post_bootstrap_script, 
-            create_certs,
-            additional_ports
+            additional_ports,
+            self.config["PersistentDockerVolume"],
+            instance_store,
+            self.config["PrefetchImages"],
+            self.config["RegistryMirror"],
+            {availability_zone: target["IpAddress"] for availability_zone, target in self.config["MountTargets"].items()},
+            self.config["IdleTimeout"],
+            self.config["IdleAction"]
         )
 
+        try:
+            image_id = resolve_image_id(
+                self.ec2_client,
+                self.config["Region"],
+                get_architecture(instance_type_info),
+                self.config["ImageId"],
+                self.config["ImageCacheTTL"]
+            )
+        except Exception as error:
+            UnhandledError(error)
+
         args = {}
-        args["ImageId"] = self.config["ImageId"]
-        args["InstanceType"] = self.args.instance_type
+        args["ImageId"] = image_id
+        args["InstanceType"] = instance_type
         if self.config["Key"]:
             args["KeyName"] = self.config["Key"]
-        args["SecurityGroupIds"] = docker_sg + [efs_sg]
+        args["SecurityGroupIds"] = security_groups
         args["SubnetId"] = self.config["SubnetId"]
-        args["MinCount"] = 1
-        args["MaxCount"] = 1
         args["UserData"] = bootstrap_script
+        # the idle monitor shuts the host down, which stops or terminates it
+        args["InstanceInitiatedShutdownBehavior"] = self.config["IdleAction"]
         args["BlockDeviceMappings"] = [
                 {
                     "DeviceName": "/dev/xvda",
@@ -292,66 +538,692 @@ class Commands():
             args["IamInstanceProfile"] = {
                 "Arn": self.config["InstanceProfileArn"]
             }
-        self.config["Tags"].append({"Key": "Name", "Value": "DockerHost"})
-        args["TagSpecifications"] = [{"Tags": self.config["Tags"], "ResourceType": "instance"}]
+        return args
+
+    def launch_instances(self, instance_type, count=1, extra_tags=[], spot=False):
+        """
+        Launch count Docker Host instances, returns list of (instance id, private dns, image id).
+        Subnets are tried in turn on capacity errors, only subnets in availability zones offering instance type
+        are used unless --subnet-id is supplied. Launch attempts are kept in self.launch_details.
+        """
+        args = self.prepare_launch(instance_type)
+        args["MinCount"] = count
+        args["MaxCount"] = count
+        tags = self.config["Tags"] + [{"Key": "Name", "Value": "DockerHost"}, self.owner_tag()] + extra_tags
+        args["TagSpecifications"] = [{"Tags": tags, "ResourceType": "instance"}]
         try:
-            response = self.ec2_client.run_instances(**args)
+            if getattr(self.args, "subnet_id", None):
+                subnets = [args["SubnetId"]]
+            else:
+                subnets = plan_subnets(
+                    self.describe_instance_types([instance_type])[instance_type],
+                    self.config["SubnetIds"],
+                    self.config["SubnetAzs"]
+                )
+            response, attempts = launch_with_fallback(self.ec2_client, args, subnets, self.config["SubnetAzs"], spot)
+        except LaunchError as error:
+            log.error(f"{error}, attempts: {error.attempts}")
+            print(f"{error}")
+            UnhandledError(error)
+        except self.ec2_client.exceptions.ClientError as error:
+            # cached subnets, security groups or AMI might no longer exist
+            InvalidateConfigCache(self.config)
+            invalidate_cache(get_image_cache_filename())
+            UnhandledError(error)
         except Exception as error:
             UnhandledError(error)
-        instance_id = response['Instances'][0]['InstanceId']
-        instance_dns = response['Instances'][0]['PrivateDnsName']
-        log.info(f"Successfully launched instance {instance_id} with private DNS {instance_dns}")
-        print(f"Successfully launched DockerHost on instance {instance_id} with private DNS {instance_dns}")
+        launch_time = sum(attempt["Duration"] for attempt in attempts)
+        print(f"Launched in {attempts[-1]['AvailabilityZone']} ({attempts[-1]['Market']}) after {len(attempts)} attempt(s), {launch_time:.1f}s")
+        instances = []
+        for instance in response['Instances']:
+            instance_id = instance['InstanceId']
+            instance_dns = instance['PrivateDnsName']
+            try:
+                # the bootstrap script waits for the certificates, so the idle monitor is written first
+                if self.config["IdleTimeout"] > 0:
+                    write_idle_monitor(get_home(), instance_type, instance_id)
+                write_host_certs(get_home(), instance_type, instance_id, instance_dns, instance['PrivateIpAddress'])
+            except Exception as error:
+                log.error(f"Failed to write certificates or idle monitor for {instance_id}, terminating it")
+                self.ec2_client.terminate_instances(InstanceIds=[instance_id])
+                UnhandledError(error)
+            self.launch_details[instance_id] = {
+                "AvailabilityZone": attempts[-1]["AvailabilityZone"],
+                "Market": attempts[-1]["Market"],
+                "LaunchAttempts": attempts
+            }
+            log.info(f"Successfully launched instance {instance_id} with private DNS {instance_dns} using image {args['ImageId']}")
+            print(f"Successfully launched DockerHost on instance {instance_id} with private DNS {instance_dns}")
+            instances.append((instance_id, instance_dns, args["ImageId"]))
+        return instances
+
+    def attach_docker_volume(self, instance_type, instance_id):
+        """
+        Attach the user docker data volume of the host availability zone (restored from the latest snapshot or
+        created when none is available) and write its id to EFS for the bootstrap script
+        """
+        if not self.config["PersistentDockerVolume"]:
+            return
+        start = time.perf_counter()
+        volume_file = f"{get_home()}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/docker-volume"
+        launch_details = self.launch_details.setdefault(instance_id, {})
+        try:
+            self.ec2_client.get_waiter("instance_running").wait(
+                InstanceIds=[instance_id],
+                WaiterConfig={"Delay": 2, "MaxAttempts": 90}
+            )
+            # threads of one command must not pick the same available volume
+            with self.volume_lock:
+                volume_id, source = attach_volume(
+                    self.ec2_client,
+                    self.owner_tag(),
+                    instance_id,
+                    launch_details["AvailabilityZone"],
+                    self.config["DockerVolumeSize"]
+                )
+            launch_details["DockerVolume"] = {"VolumeId": volume_id, "Source": source}
+            print(f"Attached docker data volume {volume_id} ({source}) to {instance_id}")
+        except Exception as error:
+            log.error(f"Failed to attach docker data volume to {instance_id}, using root volume: {error}")
+            volume_id = "none"
+        os.makedirs(os.path.dirname(volume_file), exist_ok=True)
+        with open(f"{volume_file}.tmp", "w") as file:
+            file.write(volume_id)
+        os.replace(f"{volume_file}.tmp", volume_file)
+        launch_details["DockerVolumeTime"] = round(time.perf_counter() - start, 3)
+
+    def wait_until_healthy(self, instance_type, instance_id, instance_dns, port, progress=None, terminate=True):
+        """
+        Wait for instance, certificates and docker daemon to be ready, terminate the instance if it never becomes healthy
+        (stop it when terminate is False). Returns per-phase timings.
+        """
+        home = get_home()
         print("Waiting on docker host to be ready")
-        IsHealthy = (False, "")
-        retries = 0
-        while not IsHealthy[0] and retries < max_retries:
-            time.sleep(retry_wait)
-            IsHealthy = ping_host(home, self.args.instance_type, instance_id, instance_dns, port)
-            retries += 1
+        readiness = HostReadiness(self.ec2_client, home, instance_type, instance_id, instance_dns, port, progress=progress)
+        IsHealthy = readiness.wait()
+        log.info(f"Host {instance_id} readiness timings: {readiness.format_timings()}")
 
-        if not IsHealthy[0]:
-            print("Failed to establish connection with docker daemon on DockerHost instance. Terminating instance")
+        if not IsHealthy[0] and terminate:
+            print(f"Failed to establish connection with docker daemon on DockerHost instance ({IsHealthy[1]}). Terminating instance")
             log.error("Failed to establish connection with docker daemon on DockerHost instance. Terminating instance")
             log.error(f"Not able to reach docker daemon on host: {IsHealthy[1]}")
             self.terminate_current_host(instance_id)
+        elif not IsHealthy[0]:
+            print(f"Failed to establish connection with docker daemon on DockerHost instance ({IsHealthy[1]}). Stopping instance {instance_id}")
+            log.error(f"Not able to reach docker daemon on host {instance_id}, stopping it: {IsHealthy[1]}")
+            try:
+                self.ec2_client.stop_instances(InstanceIds=[instance_id])
+                self.registry.set_state([instance_id], "stopping")
+            except Exception as error:
+                log.error(f"Failed to stop instance {instance_id}: {error}")
 
         assert IsHealthy[0], "Aborting."
+        print(f"Readiness phases: {readiness.format_timings()}")
+        return readiness.timings
 
-        print("Docker host is ready!")
-        active_host = {
-            "ActiveHosts": [
-                {
-                    "InstanceId": instance_id,
-                    "InstanceDns": instance_dns,
-                    "Port": port,
-                    "InstanceType": self.args.instance_type
+    def create_host_context(self, host):
+        """
+        Create (or replace) the docker context of a host from its certificates on EFS
+        """
+        create_context(
+            get_context_name(host["InstanceType"], host["InstanceId"]),
+            f"tcp://{host['InstanceDns']}:{host['Port']}",
+            get_cert_path(get_home(), host["InstanceType"], host["InstanceId"])
+        )
+
+    def activate_hosts(self, hosts):
+        """
+        Register hosts, create a docker context for each and switch to the first one.
+        hosts: list of {"InstanceId", "InstanceDns", "Port", "InstanceType", "ImageId"}
+        """
+        try:
+            self.registry.add_hosts([{**host, "State": "running"} for host in hosts])
+            for host in hosts:
+                # recreate context so it picks up the current certificates of the host
+                self.create_host_context(host)
+            use_context(get_context_name(hosts[0]["InstanceType"], hosts[0]["InstanceId"]))
+        except Exception as error:
+            UnhandledError(error)
+
+    def activate_host(self, instance_type, instance_id, instance_dns, port, image_id):
+        """
+        Record a single host as active host and switch docker context to it
+        """
+        self.activate_hosts([{
+            "InstanceId": instance_id,
+            "InstanceDns": instance_dns,
+            "Port": port,
+            "InstanceType": instance_type,
+            "ImageId": image_id
+        }])
+
+    def create_host(self):
+        """
+        Create Docker Host command, stopped hosts from the warm pool are used when available.
+        Several hosts are created with --count or a mixed instance type spec (eg. c5.xlarge:2,g4dn.xlarge),
+        one run_instances call is made per instance type and all hosts are health checked concurrently.
+        With --cpus, --memory and --gpus the smallest matching instance type is picked from the catalog.
+        With --no-wait hosts are registered as booting and readied by a detached watcher (see `sdocker wait`).
+        """
+        started = time.time()
+        port = self.config["Port"]
+        requirements = [self.args.cpus, self.args.memory, self.args.gpus]
+        if self.args.instance_type and any(requirements):
+            raise ValueError("--instance-type cannot be combined with --cpus, --memory or --gpus")
+        if self.args.count < 1:
+            raise ValueError(f"Invalid instance count {self.args.count}, --count must be at least 1")
+        if self.args.instance_type:
+            spec = parse_instance_spec(self.args.instance_type, self.args.count)
+        elif any(requirements):
+            spec = [(self.pick_instance_type(), self.args.count)]
+        else:
+            raise ValueError("--instance-type or at least one of --cpus, --memory and --gpus is required")
+        self.describe_instance_types([instance_type for instance_type, _ in spec])
+        hosts = []
+        for instance_type, count in spec:
+            pooled = 0
+            while pooled < count:
+                pooled_host = self.take_from_pool(instance_type)
+                if not pooled_host:
+                    break
+                hosts.append((instance_type, *pooled_host, True))
+                pooled += 1
+            if count > pooled:
+                spot = self.args.spot or self.config["UseSpot"]
+                for instance in self.launch_instances(instance_type, count - pooled, spot=spot):
+                    hosts.append((instance_type, *instance, False))
+
+        if self.args.no_wait:
+            return self.register_booting_hosts(hosts, started)
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            ready_hosts = [host for host in executor.map(lambda host: self.finish_host(*host, started), hosts) if host]
+        assert len(ready_hosts) > 0, "Aborting."
+        if len(ready_hosts) < len(hosts):
+            print(f"{len(hosts) - len(ready_hosts)} of {len(hosts)} hosts failed to become ready")
+        self.activate_hosts(ready_hosts)
+        if len(ready_hosts) > 1:
+            print(f"Docker hosts are ready: {' '.join(host['InstanceId'] for host in ready_hosts)}")
+        return ready_hosts[0]["InstanceId"], ready_hosts[0]["InstanceDns"], port
+
+    def finish_host(self, instance_type, instance_id, instance_dns, image_id, pool_hit, started, progress=None):
+        """
+        Attach docker data volume, wait until host is healthy and record launch timings. Returns the registry
+        entry of the host, or None when it failed (it is then terminated). progress is called with readiness phases
+        """
+        port = self.config["Port"]
+        if not pool_hit:
+            if progress and self.config["PersistentDockerVolume"]:
+                progress("DockerVolume")
+            self.attach_docker_volume(instance_type, instance_id)
+        try:
+            readiness_timings = self.wait_until_healthy(instance_type, instance_id, instance_dns, port, progress)
+        except AssertionError:
+            return None
+        ready_time = time.time() - started
+        launch_details = self.launch_details.get(instance_id, {})
+        record_launch({
+            "InstanceId": instance_id,
+            "InstanceType": instance_type,
+            "PoolHit": pool_hit,
+            "DockerVolume": launch_details.get("DockerVolume"),
+            "ReadyTime": round(ready_time, 1),
+            "Phases": {
+                "Startup": round(self.config.get("StartupTime", 0), 3),
+                **self.phase_timings,
+                "RunInstances": round(sum(attempt["Duration"] for attempt in launch_details.get("LaunchAttempts", [])), 3),
+                **({"DockerVolume": launch_details["DockerVolumeTime"]} if "DockerVolumeTime" in launch_details else {}),
+                **readiness_timings
+            }
+        })
+        record_pool_stats(pool_hit, ready_time, baked=image_id == self.config["BakedImageId"])
+        print(f"Docker host {instance_id} is ready! ({ready_time:.0f}s, {'warm pool hit' if pool_hit else 'warm pool miss'})")
+        log.info(f"Docker host {instance_id} ready after {ready_time:.1f}s, warm pool hit: {pool_hit}")
+        return {
+            "InstanceId": instance_id,
+            "InstanceDns": instance_dns,
+            "Port": port,
+            "InstanceType": instance_type,
+            "ImageId": image_id,
+            **self.launch_details.get(instance_id, {})
+        }
+
+    def register_booting_hosts(self, hosts, started):
+        """
+        create-host --no-wait: register launched hosts as booting and hand them over to a detached watcher.
+        Launch state the watcher needs to finish them is kept in the "Watch" field of their registry entry
+        """
+        port = self.config["Port"]
+        switch_from = current_context()
+        booting = []
+        for index, (instance_type, instance_id, instance_dns, image_id, pool_hit) in enumerate(hosts):
+            booting.append({
+                "InstanceId": instance_id,
+                "InstanceDns": instance_dns,
+                "Port": port,
+                "InstanceType": instance_type,
+                "ImageId": image_id,
+                "State": "pending",
+                "Ready": False,
+                **self.launch_details.get(instance_id, {}),
+                "Watch": {
+                    "Started": started,
+                    "PoolHit": pool_hit,
+                    "StartupTime": self.config.get("StartupTime", 0),
+                    "PhaseTimings": self.phase_timings,
+                    # first host becomes current when ready, unless the user switched context meanwhile
+                    "SwitchContextFrom": switch_from if index == 0 else None
                 }
+            })
+        try:
+            self.registry.add_hosts(booting, make_current=False)
+        except Exception as error:
+            UnhandledError(error)
+        instance_ids = [host["InstanceId"] for host in booting]
+        start_watcher(instance_ids)
+        print(f"Docker hosts are booting: {' '.join(instance_ids)}, run `sdocker wait` to block until they are ready")
+        return instance_ids
+
+    def watch_host(self):
+        """
+        Detached watcher started by create-host --no-wait: finish booting hosts concurrently, then create their
+        docker contexts and mark them ready. Hosts that fail are terminated and cleaned up by finish_host
+        """
+        hosts = [host for host in map(self.registry.get_host, self.args.instance_ids) if host and "Watch" in host]
+
+        def watch(host):
+            instance_id = host["InstanceId"]
+            watch = host["Watch"]
+            phases = []
+
+            def progress(phase):
+                phases.append(phase)
+                write_watch_status(instance_id, "waiting", phase)
+
+            self.launch_details[instance_id] = {
+                key: host[key] for key in ["AvailabilityZone", "Market", "LaunchAttempts"] if key in host.keys()
+            }
+            try:
+                ready_host = self.finish_host(
+                    host["InstanceType"], instance_id, host["InstanceDns"], host["ImageId"], watch["PoolHit"],
+                    watch["Started"], progress
+                )
+                if ready_host is None:
+                    write_watch_status(instance_id, "failed", Error=f"not ready in phase {phases[-1] if phases else 'Launched'}, instance terminated")
+                    return
+                self.registry.add_hosts([{**ready_host, "State": "running", "Ready": True}], make_current=False)
+                self.create_host_context(ready_host)
+                context = get_context_name(host["InstanceType"], instance_id)
+                if watch["SwitchContextFrom"] is not None and current_context() == watch["SwitchContextFrom"]:
+                    self.registry.set_current(instance_id)
+                    use_context(context)
+                write_watch_status(instance_id, "ready", ReadyTime=round(time.time() - watch["Started"], 1), Context=context)
+            except Exception as error:
+                log.error(f"Watcher failed for {instance_id}: {error}")
+                write_watch_status(instance_id, "failed", Error=str(error))
+
+        if len(hosts) == 0:
+            return
+        self.config["StartupTime"] = hosts[0]["Watch"]["StartupTime"]
+        self.phase_timings = hosts[0]["Watch"]["PhaseTimings"]
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            list(executor.map(watch, hosts))
+
+    def wait(self):
+        """
+        Block until hosts readied in the background are ready or failed, all booting hosts by default.
+        Prints a line whenever a host moves to another phase, and a reminder of what is still pending every progress_interval
+        """
+        instance_ids = self.args.instance_ids or [
+            host["InstanceId"] for host in self.registry.hosts() if host.get("Ready") is False
+        ]
+        if len(instance_ids) == 0:
+            print("No hosts are booting")
+            return
+        start = time.time()
+        last_progress = start
+        shown = {}
+        while True:
+            statuses = {}
+            for instance_id in instance_ids:
+                status = read_watch_status(instance_id)
+                if status is None:
+                    host = self.registry.get_host(instance_id)
+                    ready = host is not None and host.get("Ready", True)
+                    status = {"InstanceId": instance_id, "Status": "ready" if ready else "failed",
+                              "Error": None if ready else "no watcher status found"}
+                statuses[instance_id] = status
+                key = (status["Status"], status.get("Phase"))
+                if shown.get(instance_id) != key:
+                    print(format_watch_status(status, time.time() - start))
+                    shown[instance_id] = key
+            waiting = [instance_id for instance_id, status in statuses.items() if status["Status"] == "waiting"]
+            if len(waiting) == 0:
+                break
+            if time.time() - last_progress >= progress_interval:
+                last_progress = time.time()
+                pending = ", ".join(f"{instance_id} ({statuses[instance_id]['Phase']})" for instance_id in waiting)
+                print(f"{time.time() - start:>5.0f}s waiting on {pending}")
+            time.sleep(1)
+        failed = [instance_id for instance_id, status in statuses.items() if status["Status"] == "failed"]
+        ready = [instance_id for instance_id in instance_ids if instance_id not in failed]
+        if ready:
+            print(f"Docker hosts are ready: {' '.join(ready)}")
+        assert len(failed) == 0, f"Hosts failed to become ready: {' '.join(failed)}"
+
+    def describe_pool(self, instance_type=None, states=["pending", "running", "stopping", "stopped"]):
+        """
+        List warm pool instances owned by current user, filtered by instance type
+        """
+        filters = [
+            {"Name": "tag:sdocker:Owner", "Values": [self.owner_tag()["Value"]]},
+            {"Name": "tag-key", "Values": ["sdocker:Pool"]},
+            {"Name": "instance-state-name", "Values": states}
+        ]
+        if instance_type:
+            filters.append({"Name": "instance-type", "Values": [instance_type]})
+        instances = []
+        paginator = self.ec2_client.get_paginator("describe_instances")
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page["Reservations"]:
+                instances.extend(reservation["Instances"])
+        return instances
+
+    def take_from_pool(self, instance_type):
+        """
+        Claim and start a stopped warm pool instance, returns (instance id, private dns, image id) or None.
+        The start_instances call is the claim: only the caller that saw the instance leave the stopped state owns it,
+        concurrent create-host calls starting the same instance move on to the next candidate
+        """
+        try:
+            subnet_id = getattr(self.args, "subnet_id", None) and self.get_subnet_id()
+            candidates = [
+                instance for instance in self.describe_pool(instance_type, states=["stopped"])
+                if not subnet_id or instance["SubnetId"] == subnet_id
             ]
-        }
+        except self.ec2_client.exceptions.ClientError as error:
+            log.error(f"Unable to query warm pool: {error}")
+            return None
+        for instance in candidates:
+            instance_id = instance["InstanceId"]
+            try:
+                starting = self.ec2_client.start_instances(InstanceIds=[instance_id])["StartingInstances"][0]
+            except self.ec2_client.exceptions.ClientError as error:
+                log.error(f"Unable to start warm pool instance {instance_id}: {error}")
+                continue
+            if starting["PreviousState"]["Name"] != "stopped":
+                log.info(f"Warm pool instance {instance_id} was claimed by another caller ({starting['PreviousState']['Name']})")
+                continue
+            try:
+                self.ec2_client.delete_tags(Resources=[instance_id], Tags=[{"Key": "sdocker:Pool"}])
+            except self.ec2_client.exceptions.ClientError as error:
+                log.error(f"Unable to remove sdocker:Pool tag of claimed instance {instance_id}: {error}")
+            log.info(f"Starting warm pool instance {instance_id}")
+            print(f"Starting DockerHost from warm pool on instance {instance_id} with private DNS {instance['PrivateDnsName']}")
+            return (instance_id, instance["PrivateDnsName"], instance["ImageId"])
+        return None
+
+    def wait_for_bootstrap(self, instance_type, instance_id):
+        """
+        Wait until bootstrap script has copied its logs to EFS, which is the last bootstrap step
+        """
+        bootstrap_log = f"{get_home()}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/dockerd-logs/bootstrap.log"
+        retries = 0
+        while not os.path.exists(bootstrap_log) and retries < max_retries:
+            time.sleep(retry_wait)
+            retries += 1
+        return os.path.exists(bootstrap_log)
+
+    def pool(self):
+        """
+        Warm pool command, `fill` tops up stopped pre-bootstrapped hosts, `status` reports pool and hit rate
+        """
+        if self.args.action == "fill":
+            if not self.args.instance_type:
+                raise ValueError("--instance-type is required for pool fill")
+            size = int(self.args.size)
+            existing = self.describe_pool(self.args.instance_type)
+            missing = size - len(existing)
+            if missing <= 0:
+                print(f"Warm pool for {self.args.instance_type} already has {len(existing)} hosts")
+                return
+            port = self.config["Port"]
+            instances = self.launch_instances(
+                self.args.instance_type,
+                count=missing,
+                extra_tags=[{"Key": "sdocker:Pool", "Value": self.args.instance_type}]
+            )
+            for instance_id, instance_dns, _ in instances:
+                self.attach_docker_volume(self.args.instance_type, instance_id)
+                self.wait_until_healthy(self.args.instance_type, instance_id, instance_dns, port)
+                if not self.wait_for_bootstrap(self.args.instance_type, instance_id):
+                    log.error(f"Bootstrap logs not found for {instance_id}, stopping it anyway")
+            instance_ids = [instance[0] for instance in instances]
+            try:
+                self.ec2_client.stop_instances(InstanceIds=instance_ids)
+            except Exception as error:
+                UnhandledError(error)
+            print(f"Added {len(instance_ids)} stopped hosts to {self.args.instance_type} warm pool: {' '.join(instance_ids)}")
+            log.info(f"Added {instance_ids} to {self.args.instance_type} warm pool")
+        else:
+            pool_instances = {}
+            for instance in self.describe_pool(self.args.instance_type):
+                pool_instances.setdefault(instance["InstanceType"], []).append(
+                    f"{instance['InstanceId']} ({instance['State']['Name']})"
+                )
+            for instance_type, instances in pool_instances.items():
+                print(f"{instance_type}: {', '.join(instances)}")
+            if len(pool_instances) == 0:
+                print("Warm pool is empty")
+            print(format_pool_stats())
+
+    def bake_ami(self):
+        """
+        Bake a host AMI: launch a builder from the configured image, pull dind and PrefetchImages docker images,
+        create an AMI from the stopped builder and record it as ImageId in sdocker.conf
+        """
+        start = time.perf_counter()
+        instance_type = self.args.instance_type
+        docker_images = [self.config["DockerImageURI"], self.config["DockerImageNvidiaURI"], *self.config["PrefetchImages"]]
+        if self.config["RegistryMirror"] == "local":
+            docker_images.append(mirror_image)
+        bake_version = time.strftime("%Y%m%d%H%M%S")
+        args = self.prepare_launch(instance_type)
+        args["MinCount"] = 1
+        args["MaxCount"] = 1
+        args["UserData"] = generate_bake_script(docker_images, bake_version)
+        args["InstanceInitiatedShutdownBehavior"] = "stop"
+        tags = self.config["Tags"] + [
+            {"Key": "Name", "Value": "DockerHostBuilder"},
+            {"Key": "sdocker:Builder", "Value": bake_version},
+            self.owner_tag()
+        ]
+        args["TagSpecifications"] = [{"Tags": tags, "ResourceType": "instance"}]
+        try:
+            instance_id = self.ec2_client.run_instances(**args)["Instances"][0]["InstanceId"]
+        except Exception as error:
+            UnhandledError(error)
+        print(f"Launched builder instance {instance_id} from {args['ImageId']}, pulling {' '.join(docker_images)}")
+        log.info(f"Launched builder instance {instance_id} from {args['ImageId']}")
+        try:
+            self.ec2_client.get_waiter("instance_stopped").wait(
+                InstanceIds=[instance_id],
+                WaiterConfig={"Delay": 15, "MaxAttempts": 120}
+            )
+            print("Builder finished, creating image")
+            image_id = self.ec2_client.create_image(
+                InstanceId=instance_id,
+                Name=f"sdocker-{self.config['UserProfile']}-{bake_version}",
+                Description=f"sdocker baked Docker Host image from {args['ImageId']}",
+                TagSpecifications=[{"ResourceType": "image", "Tags": [self.owner_tag()]}]
+            )["ImageId"]
+            self.ec2_client.get_waiter("image_available").wait(
+                ImageIds=[image_id],
+                WaiterConfig={"Delay": 15, "MaxAttempts": 240}
+            )
+        except Exception as error:
+            UnhandledError(error)
+        finally:
+            self.ec2_client.terminate_instances(InstanceIds=[instance_id])
+
+        config_file = f"{get_home()}/.sagemaker_studio_docker_cli/sdocker.conf"
+        try:
+            config_data = ReadFromFile(config_file, report_err=False)
+        except FileNotFoundError:
+            config_data = {}
+        config_data["ImageId"] = image_id
+        config_data["BakedImageId"] = image_id
+        atomic_write_json(config_file, config_data)
+        print(f"Baked image {image_id} in {time.perf_counter() - start:.0f}s, recorded as ImageId in {config_file}")
+        log.info(f"Baked image {image_id} from {args['ImageId']}")
+
+    def timings(self):
+        """
+        Launch latency report, client phases merged with bootstrap phases from EFS.
+        Shows a single launch when instance id is supplied, percentiles across all launches otherwise
+        """
+        print(format_report(load_launches(self.args.instance_id)))
+
+    def build(self):
+        """
+        Build an image on a host from a context on the EFS home: a builder container next to the docker daemon reads
+        the context where the host mounts EFS and builds it with BuildKit, only the build command crosses the network.
+        Defaults to current host
+        """
+        start = time.perf_counter()
         home = get_home()
+        host = self.registry.get_host(self.args.instance_id) if self.args.instance_id else self.registry.current_host()
+        if not host:
+            message = "Host not found in sdocker-hosts.conf"
+            log.error(message)
+            raise ValueError(message)
+        context = check_under_home(self.args.context, home)
+        dockerfile = check_under_home(self.args.file or os.path.join(context, "Dockerfile"), home)
+        if self.args.cache == "efs":
+            os.makedirs(f"{home}/{efs_cache_dir}", exist_ok=True)
+        client = get_client(home, host["InstanceType"], host["InstanceId"], host["InstanceDns"], host["Port"])
+        spec = builder_spec(
+            home,
+            get_cert_path(home, host["InstanceType"], host["InstanceId"]),
+            context,
+            dockerfile,
+            self.args.tag,
+            self.args.build_arg,
+            self.args.target,
+            self.args.cache
+        )
+        print(f"Building {context} on {host['InstanceId']} ({host['InstanceDns']})")
+        log.info(f"Building {context} on {host['InstanceId']}: {spec['Cmd'][0]}")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # context size is only needed for the report, walk EFS while the build runs
+            size = executor.submit(context_size, context)
+            try:
+                if not client.image_exists(builder_image):
+                    client.pull(builder_image)
+                exit_code = client.run(spec)
+            except Exception as error:
+                UnhandledError(error)
+        if exit_code != 0:
+            message = f"Build failed with exit code {exit_code}"
+            log.error(message)
+            raise RuntimeError(message)
+        report = format_upload_saved(size.result(), time.perf_counter() - start)
+        print(report)
+        log.info(report)
+
+    def stop_host(self):
+        """
+        Stop Docker Host, defaults to current host
+        """
+        instance_id = self.args.instance_id
+        current_host = self.registry.current_host()
+        if not instance_id:
+            if not current_host:
+                message = "No current host found in sdocker-hosts.conf"
+                log.error(message)
+                raise ValueError(message)
+            instance_id = current_host["InstanceId"]
         try:
-            with open(f"{home}/.sagemaker_studio_docker_cli/sdocker-hosts.conf", "w") as file:
-                json.dump(active_host, file)
-            create_context_command = f"docker context create {self.args.instance_type}_{instance_id}" \
-                + f" --docker host=tcp://{instance_dns}:{port}" \
-                + f",ca={home}/.sagemaker_studio_docker_cli/{self.args.instance_type}_{instance_id}/certs/ca/cert.pem" \
-                + f",cert={home}/.sagemaker_studio_docker_cli/{self.args.instance_type}_{instance_id}/certs/client/cert.pem" \
-                + f",key={home}/.sagemaker_studio_docker_cli/{self.args.instance_type}_{instance_id}/certs/client/key.pem"
-            log.info(f"Running OS level command: {create_context_command}{log_cmd}") 
-            os.system(create_context_command + log_cmd)
-            exit_code = -1
-            retry_count = 0
-            max_retry = 5
-            time.sleep(2)
-            while exit_code != 0 and retry_count < max_retry:
-                log.info(f"Running OS level command: docker context use {self.args.instance_type}_{instance_id}{log_cmd}") 
-                exit_code = os.system(f"docker context use {self.args.instance_type}_{instance_id}" + log_cmd)
-                log.info(f"Exit code for above command: {exit_code}")
-                if exit_code != 0:
-                    log.error("Unable to switch context, retrying....")
-                    time.sleep(1)
-                retry_count += 1
+            self.ec2_client.stop_instances(InstanceIds=[instance_id])
         except Exception as error:
             UnhandledError(error)
-        return instance_id, instance_dns, port
+        self.registry.set_state([instance_id], "stopping")
+        if current_context().endswith(f"_{instance_id}"):
+            use_context(default_context)
+        print(f"Stopping instance {instance_id}")
+        log.info(f"Stopping instance {instance_id}")
+
+    def start_host(self):
+        """
+        Start a stopped Docker Host and make it the active host, a host that does not become healthy is stopped again
+        """
+        instance_id = self.args.instance_id
+        try:
+            instance = self.ec2_client.describe_instances(InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]
+            self.ec2_client.start_instances(InstanceIds=[instance_id])
+        except Exception as error:
+            UnhandledError(error)
+        start = time.perf_counter()
+        port = self.config["Port"]
+        self.wait_until_healthy(instance["InstanceType"], instance_id, instance["PrivateDnsName"], port, terminate=False)
+        print(f"Docker host is ready! ({time.perf_counter() - start:.0f}s)")
+        self.activate_host(instance["InstanceType"], instance_id, instance["PrivateDnsName"], port, instance["ImageId"])
+
+
+def parse_instance_spec(spec, count=1):
+    """
+    Parse instance type spec, "c5.xlarge" launches count hosts, "c5.xlarge:2,g4dn.xlarge" launches
+    2 c5.xlarge and 1 g4dn.xlarge hosts. Returns list of (instance type, count)
+    """
+    entries = [entry.strip() for entry in spec.split(",") if entry.strip()]
+    if len(entries) == 1 and ":" not in entries[0]:
+        return [(entries[0], count)]
+    instance_spec = []
+    for entry in entries:
+        instance_type, _, entry_count = entry.partition(":")
+        if entry_count and (not entry_count.isdigit() or int(entry_count) < 1):
+            raise ValueError(f"Invalid instance count in \"{entry}\"")
+        instance_spec.append((instance_type, int(entry_count) if entry_count else 1))
+    return instance_spec
+
+
+def has_nvme_instance_store(instance_type_info):
+    """
+    True when instance type comes with local NVMe instance store volumes
+    """
+    storage = instance_type_info.get("InstanceStorageInfo", {})
+    return instance_type_info.get("InstanceStorageSupported", False) and storage.get("NvmeSupport") in ["required", "supported"]
+
+
+def get_pool_stats_filename():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/pool-stats.json"
+
+
+def record_pool_stats(hit, ready_time, baked=False):
+    """
+    Keep warm pool hit/miss counts and last time-to-ready samples, new launches are also
+    sampled by baked/unbaked image
+    """
+    try:
+        stats = load_cache(get_pool_stats_filename())
+        key = "Hits" if hit else "Misses"
+        stats[key] = stats.get(key, 0) + 1
+        sample_keys = [key] if hit else [key, "Baked" if baked else "Unbaked"]
+        for sample_key in sample_keys:
+            samples = stats.setdefault("ReadyTimes", {}).setdefault(sample_key, [])
+            samples.append(round(ready_time, 1))
+            stats["ReadyTimes"][sample_key] = samples[-pool_stats_samples:]
+        atomic_write_json(get_pool_stats_filename(), stats)
+    except Exception as error:
+        log.error(f"Failed to record warm pool stats: {error}")
+
+
+def format_pool_stats():
+    stats = load_cache(get_pool_stats_filename())
+    hits, misses = stats.get("Hits", 0), stats.get("Misses", 0)
+    if hits + misses == 0:
+        return "No create-host calls recorded"
+    lines = [f"Warm pool hit rate: {100 * hits / (hits + misses):.0f}% ({hits} hits, {misses} misses)"]
+    for key, samples in stats.get("ReadyTimes", {}).items():
+        if samples:
+            lines.append(f"Median time-to-ready ({key.lower()}): {sorted(samples)[len(samples) // 2]}s")
+    return "\n".join(lines)
@@ -1,7 +1,23 @@
 import os
+import sys
 import json
-import boto3
+import time
+import hashlib
+import subprocess
 import logging as log
+from cache import read_cache, write_cache, invalidate_cache, load_cache, atomic_write_json
+from discovery import run_task_graph, format_timings
+from concurrent.futures import ThreadPoolExecutor
+
+default_cache_ttl = 12 * 3600
+default_image_cache_ttl = 24 * 3600
+default_instance_catalog_ttl = 7 * 24 * 3600
+default_idle_timeout = 2 * 3600
+background_refresh_wait = 60
+# bump when discovered configuration fields change, so older cache entries are discarded
+config_cache_version = "9"
+internal_metadata = "/opt/.sagemakerinternal/internal-metadata.json"
+resource_metadata = "/opt/ml/metadata/resource-metadata.json"
 
 def get_home():
     """
@@ -30,17 +46,116 @@ def ReadFromFile(filename, report_err=True):
     except Exception as error:
         UnhandledError(error)
 
+def get_config_cache_filename():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/config-cache.json"
+
+
+def get_config_cache_key(config):
+    """
+    Cache entries are keyed by Studio domain, user profile and region
+    """
+    return f"{config['DomainId']}|{config['UserProfile']}|{config['Region']}"
+
+
+def get_config_fingerprint():
+    """
+    Hash of sdocker.conf and cache version, any change to the configuration file invalidates cached config
+    """
+    config_file = f"{get_home()}/.sagemaker_studio_docker_cli/sdocker.conf"
+    try:
+        with open(config_file, "rb") as file:
+            config_bytes = file.read()
+    except FileNotFoundError:
+        config_bytes = b""
+    return hashlib.sha256(config_cache_version.encode() + config_bytes).hexdigest()
+
+
+def get_cache_ttl():
+    """
+    Read ConfigCacheTTL (seconds) from sdocker.conf, default is 12 hours
+    """
+    config_file = f"{get_home()}/.sagemaker_studio_docker_cli/sdocker.conf"
+    try:
+        config_data = ReadFromFile(config_file, report_err=False)
+    except FileNotFoundError:
+        config_data = {}
+    if "ConfigCacheTTL" in config_data.keys() and type(config_data["ConfigCacheTTL"]) == int:
+        return config_data["ConfigCacheTTL"]
+    return default_cache_ttl
+
+
+def get_snapshot_docker_volume():
+    """
+    Read SnapshotDockerVolume from sdocker.conf, so terminate commands do not need the discovered configuration
+    """
+    config_file = f"{get_home()}/.sagemaker_studio_docker_cli/sdocker.conf"
+    try:
+        config_data = ReadFromFile(config_file, report_err=False)
+    except FileNotFoundError:
+        config_data = {}
+    return config_data.get("SnapshotDockerVolume") is True
+
+
+def InvalidateConfigCache(config):
+    """
+    Drop cached configuration, used when cached resources are found to be stale
+    """
+    log.info("Invalidating cached SageMaker Studio configuration")
+    invalidate_cache(get_config_cache_filename(), get_config_cache_key(config))
+
+
+def UpdateConfigCache(config, values):
+    """
+    Add values resolved by commands (eg. security group ids) to the cached configuration, entry age is kept
+    """
+    try:
+        cache_filename = get_config_cache_filename()
+        data = load_cache(cache_filename)
+        entry = data.get(get_config_cache_key(config))
+        if entry:
+            entry["Value"].update(values)
+            atomic_write_json(cache_filename, data)
+    except Exception as error:
+        log.error(f"Failed to update configuration cache: {error}")
+
+
+def RefreshConfigInBackground():
+    """
+    Start a detached `sdocker config refresh` process, at most once every background_refresh_wait seconds
+    """
+    marker = f"{get_home()}/.sagemaker_studio_docker_cli/.config-refresh"
+    try:
+        if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < background_refresh_wait:
+            return
+        with open(marker, "w") as file:
+            file.write(str(os.getpid()))
+        sdocker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sdocker")
+        subprocess.Popen(
+            [sys.executable, sdocker, "config", "refresh"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        log.info("Started background refresh of SageMaker Studio configuration")
+    except Exception as error:
+        log.error(f"Failed to start background config refresh: {error}")
+
+
 class ReadConfig():
-    def __init__(self):
+    def __init__(self, refresh=False, fields=None):
         """
-        Prepare configuration based on Studio, networking and configuration file
+        Prepare configuration based on Studio, networking and configuration file.
+        Discovered configuration is cached in ~/.sagemaker_studio_docker_cli/config-cache.json,
+        entries older than half of ConfigCacheTTL are refreshed in the background and
+        entries older than ConfigCacheTTL, or created with a different sdocker.conf, are discarded.
+        fields: configuration keys required by the command, when all of them are available from
+        Studio metadata files the cache and discovery API calls are skipped. None means all fields.
         """ 
         log.info("Fetching SageMaker Studio configuration")
         self.config={}
-        
-        internal_metadata = "/opt/.sagemakerinternal/internal-metadata.json"
-        resource_metadata = "/opt/ml/metadata/resource-metadata.json"
-        
+        self.cache_age = None
+
         internal_meta = ReadFromFile(internal_metadata)
         resource_meta = ReadFromFile(resource_metadata)
         
@@ -56,24 +171,120 @@ class ReadConfig():
             log.error("SageMaker Studio Domain must be in \"VPCOnly mode\".")
         assert self.config["VPCOnly"], "SageMaker Studio Domain must be in \"VPCOnly mode\"."
 
-        self.ReadReqConfig()
-        self.ReadOptionalConfig()
+        if fields is not None and all(field in self.config.keys() for field in fields):
+            log.info(f"Skipping discovery, required configuration {fields} is available locally")
+            return
+
+        cache_filename = get_config_cache_filename()
+        cache_key = get_config_cache_key(self.config)
+        fingerprint = get_config_fingerprint()
+        ttl = get_cache_ttl()
+        if not refresh:
+            cached_config, self.cache_age = read_cache(cache_filename, cache_key, ttl, fingerprint)
+            if cached_config:
+                log.info(f"Using cached configuration ({int(self.cache_age)}s old)")
+                self.config.update(cached_config)
+                if self.cache_age > ttl / 2:
+                    RefreshConfigInBackground()
+                log.debug(f"Resource: {self.config}")
+                return
+
+        self.Discover()
+        # security groups resolved by commands stay valid as long as the VPC is the same
+        previous_config, _ = read_cache(cache_filename, cache_key)
+        if previous_config and previous_config.get("VpcId") == self.config["VpcId"] and "ResolvedSecurityGroups" in previous_config:
+            self.config["ResolvedSecurityGroups"] = previous_config["ResolvedSecurityGroups"]
+        try:
+            write_cache(cache_filename, cache_key, self.config, fingerprint)
+            self.cache_age = 0
+        except Exception as error:
+            log.error(f"Failed to write configuration cache: {error}")
         log.debug(f"Resource: {self.config}")
         
 
-    def ReadReqConfig(self):
+    def Discover(self):
         """
-        This function reads configuration from sagemaker:DescribeDomain, sagemaker:ListTags and EFS:DescribeMountTargets API calls
+        Run discovery API calls as a dependency graph on a thread pool, clients share one botocore session
         """
+        home = get_home()
+        config_file = f"{home}/.sagemaker_studio_docker_cli/sdocker.conf"
+        try:
+            config_data = ReadFromFile(config_file, report_err=False)
+        except FileNotFoundError:
+            config_data = {}
+
+        import boto3
+
         try:
-            sm_client = boto3.client("sagemaker", region_name=self.config["Region"])
-            domain_reponse = sm_client.describe_domain(DomainId=self.config["DomainId"])
-            UserProfile_reponse = sm_client.describe_user_profile(
+            session = boto3.session.Session(region_name=self.config["Region"])
+            self.sm_client = session.client("sagemaker")
+            self.efs_client = session.client("efs")
+            self.ec2_client = session.client("ec2")
+            tasks = self.ReqConfigTasks()
+            results, timings = run_task_graph(tasks)
+        except Exception as error:
+            UnhandledError(error)
+        log.info(f"Discovery timings:\n{format_timings(timings)}")
+        self.config["DiscoveryTimings"] = timings
+        self.ReadReqConfig(results)
+        self.ReadOptionalConfig(config_data)
+
+
+    def ReqConfigTasks(self):
+        """
+        sagemaker:DescribeDomain, sagemaker:DescribeUserProfile, sagemaker:ListTags, ec2:DescribeSubnets,
+        EFS:DescribeMountTargets and EFS:DescribeMountTargetSecurityGroups calls and their dependencies
+        """
+        def describe_mount_target_security_groups(mount_targets):
+            # security groups of every mount target, hosts use the mount target in their availability zone
+            with ThreadPoolExecutor(max_workers=len(mount_targets) or 1) as executor:
+                return dict(zip(
+                    [mount_target["MountTargetId"] for mount_target in mount_targets],
+                    executor.map(
+                        lambda mount_target: self.efs_client.describe_mount_target_security_groups(
+                            MountTargetId=mount_target["MountTargetId"]
+                        )["SecurityGroups"],
+                        mount_targets
+                    )
+                ))
+
+        return {
+            "describe_domain": ([], lambda _: self.sm_client.describe_domain(
+                DomainId=self.config["DomainId"]
+            )),
+            "describe_user_profile": ([], lambda _: self.sm_client.describe_user_profile(
                 DomainId=self.config["DomainId"],
                 UserProfileName=self.config["UserProfile"]
+            )),
+            # TODO add pagination support
+            "list_tags": (["describe_user_profile"], lambda deps: self.sm_client.list_tags(
+                ResourceArn=deps["describe_user_profile"]["UserProfileArn"]
+            )),
+            "describe_subnets": (["describe_domain"], lambda deps: self.ec2_client.describe_subnets(
+                SubnetIds=deps["describe_domain"]["SubnetIds"]
+            )),
+            "describe_mount_targets": (["describe_domain"], lambda deps: self.efs_client.describe_mount_targets(
+                FileSystemId=deps["describe_domain"]["HomeEfsFileSystemId"]
+            )),
+            "describe_mount_target_security_groups": (
+                ["describe_mount_targets"],
+                lambda deps: describe_mount_target_security_groups(deps["describe_mount_targets"]["MountTargets"])
             )
+        }
+
+
+    def ReadReqConfig(self, results):
+        """
+        This function reads configuration from sagemaker:DescribeDomain, sagemaker:ListTags and EFS:DescribeMountTargets API calls
+        """
+        try:
+            domain_reponse = results["describe_domain"]
+            UserProfile_reponse = results["describe_user_profile"]
             self.config["SubnetIds"] = domain_reponse["SubnetIds"]
             self.config["VpcId"] = domain_reponse["VpcId"]
+            self.config["SubnetAzs"] = {
+                subnet["SubnetId"]: subnet["AvailabilityZone"] for subnet in results["describe_subnets"]["Subnets"]
+            }
             self.config["EfsId"] = domain_reponse["HomeEfsFileSystemId"]
             self.config["UserUid"] = UserProfile_reponse["HomeEfsFileSystemUid"]
             if "UserSettings"  in UserProfile_reponse.keys() and "SecurityGroups" in UserProfile_reponse["UserSettings"].keys():
@@ -85,28 +296,31 @@ class ReadConfig():
             else:
                 self.config["ExecutionRole"] = domain_reponse["DefaultUserSettings"]["ExecutionRole"]
             self.config["UserProfileArn"] = UserProfile_reponse["UserProfileArn"]
-            # TODO add pagination support
-            Tags_reponse = sm_client.list_tags(ResourceArn=self.config["UserProfileArn"])
-            self.config["Tags"] = Tags_reponse["Tags"]
-            efs_client = boto3.client("efs", region_name=self.config["Region"])
-            self.config["EFSClient"] = efs_client
-            Efs_response = efs_client.describe_mount_targets(FileSystemId=self.config["EfsId"])
+            self.config["Tags"] = results["list_tags"]["Tags"]
+            Efs_response = results["describe_mount_targets"]
             self.config["EfsIpAddress"] = Efs_response["MountTargets"][0]["IpAddress"]
-            self.config["NetworkInterfaceId"] = Efs_response["MountTargets"][0]["NetworkInterfaceId"]
             self.config["MountTargetId"] = Efs_response["MountTargets"][0]["MountTargetId"]
-            Mount_target_response = efs_client.describe_mount_target_security_groups(
-                MountTargetId=self.config["MountTargetId"]
-            )
-            self.config["MountTargetSecurityGroups"] = Mount_target_response["SecurityGroups"]
+            mount_target_security_groups = results["describe_mount_target_security_groups"]
+            self.config["MountTargets"] = {
+                mount_target["AvailabilityZoneName"]: {
+                    "MountTargetId": mount_target["MountTargetId"],
+                    "IpAddress": mount_target["IpAddress"],
+                    "SecurityGroups": mount_target_security_groups[mount_target["MountTargetId"]]
+                }
+                for mount_target in Efs_response["MountTargets"]
+            }
         except Exception as error:
             UnhandledError(error)
 
 
-    def ReadOptionalConfig(self):
+    def ReadOptionalConfig(self, config_data):
         """
         Read optional configuration from ~//.sagemaker_studio_docker_cli/sdocker.conf
         Properties:
-            ImageId: AMI id used for Docker Host EC2 instance.
+            ImageId: AMI id, or "resolve:ssm:<parameter name>" alias, used for Docker Host EC2 instance.
+                     Newest AWS Deep Learning Base AMI is resolved per instance architecture when not set.
+            ImageCacheTTL: seconds resolved AMI ids are cached, default is 24 hours.
+            InstanceCatalogTTL: seconds the instance type catalog of the region is cached, default is 7 days.
             Key: SSH key name.
             Port: port number used to connect to docker daemon, default is 1111.
             EBSVolumeSize: EBS volume size used, default is 400 GB.
@@ -114,30 +328,32 @@ class ReadConfig():
             HostSGs: list of security group ids.
             DockerImageURI: docker image used for CPU instances.
             DockerImageNvidiaURI: docker image used for GPU instances.
+            UseSpot: launch hosts on Spot capacity with on-demand fallback, default is false.
+            PrefetchImages: list of docker images pulled into baked AMIs and, at bootstrap, into the docker daemon.
+            RegistryMirror: registry mirror URL used by the docker daemon, or "local" to run a pull-through
+                            cache of Docker Hub on the host.
+            BakedImageId: AMI created by bake-ami, written by sdocker.
+            PersistentDockerVolume: keep docker data on an EBS volume reattached to new hosts, default is false.
+            DockerVolumeSize: size of the docker data volume, default is 200 GB.
+            SnapshotDockerVolume: snapshot the docker data volume when terminating hosts, default is false.
+            UseInstanceStore: use local NVMe instance store as docker data-root when available, default is true.
+            IdleTimeout: seconds without docker activity or CPU/GPU use after which a host shuts itself down,
+                         default is 2 hours, 0 disables the idle monitor.
+            IdleAction: "terminate" (default) or "stop" idle hosts, Spot hosts are always terminated.
         """
-
-        home = get_home()
-        config_file = f"{home}/.sagemaker_studio_docker_cli/sdocker.conf"
-
-        try:
-            config_data = ReadFromFile(config_file, report_err=False)
-        except FileNotFoundError:
-            config_data = {}
-
         try:
-            ec2_client = boto3.client("ec2", region_name=self.config["Region"])
-            if "ImageId" not in config_data.keys():
-                Image_response = ec2_client.describe_images(
-                    Owners=["amazon"],
-                    Filters=[{
-                        "Name": "name",
-                        "Values": ["AWS Deep Learning Base AMI (Amazon Linux 2) Version *"]
-                    }]
-                )
-                image_id = Image_response["Images"][0]["ImageId"]
-            else:
-                image_id = config_data["ImageId"]
-            self.config["ImageId"] = image_id
+            if "ImageId" in config_data.keys():
+                self.config["ImageId"] = config_data["ImageId"]
+            else:
+                self.config["ImageId"] = None
+            if "ImageCacheTTL" in config_data.keys() and type(config_data["ImageCacheTTL"]) == int:
+                self.config["ImageCacheTTL"] = config_data["ImageCacheTTL"]
+            else:
+                self.config["ImageCacheTTL"] = default_image_cache_ttl
+            if "InstanceCatalogTTL" in config_data.keys() and type(config_data["InstanceCatalogTTL"]) == int:
+                self.config["InstanceCatalogTTL"] = config_data["InstanceCatalogTTL"]
+            else:
+                self.config["InstanceCatalogTTL"] = default_instance_catalog_ttl
             if "Key" in config_data.keys():
                 self.config["Key"] = config_data["Key"]
             else:
@@ -166,6 +382,46 @@ class ReadConfig():
                 self.config["DockerImageNvidiaURI"] = config_data["DockerImageNvidiaURI"]
             else:
                 self.config["DockerImageNvidiaURI"] = "brandsight/dind:nvidia-docker"
+            if "PrefetchImages" in config_data.keys() and type(config_data["PrefetchImages"]) == list:
+                self.config["PrefetchImages"] = config_data["PrefetchImages"]
+            else:
+                self.config["PrefetchImages"] = []
+            if "BakedImageId" in config_data.keys():
+                self.config["BakedImageId"] = config_data["BakedImageId"]
+            else:
+                self.config["BakedImageId"] = None
+            if "UseSpot" in config_data.keys() and type(config_data["UseSpot"]) == bool:
+                self.config["UseSpot"] = config_data["UseSpot"]
+            else:
+                self.config["UseSpot"] = False
+            if "PersistentDockerVolume" in config_data.keys() and type(config_data["PersistentDockerVolume"]) == bool:
+                self.config["PersistentDockerVolume"] = config_data["PersistentDockerVolume"]
+            else:
+                self.config["PersistentDockerVolume"] = False
+            if "DockerVolumeSize" in config_data.keys() and type(config_data["DockerVolumeSize"]) == int:
+                self.config["DockerVolumeSize"] = config_data["DockerVolumeSize"]
+            else:
+                self.config["DockerVolumeSize"] = 200
+            if "SnapshotDockerVolume" in config_data.keys() and type(config_data["SnapshotDockerVolume"]) == bool:
+                self.config["SnapshotDockerVolume"] = config_data["SnapshotDockerVolume"]
+            else:
+                self.config["SnapshotDockerVolume"] = False
+            if "UseInstanceStore" in config_data.keys() and type(config_data["UseInstanceStore"]) == bool:
+                self.config["UseInstanceStore"] = config_data["UseInstanceStore"]
+            else:
+                self.config["UseInstanceStore"] = True
+            if "IdleTimeout" in config_data.keys() and type(config_data["IdleTimeout"]) == int:
+                self.config["IdleTimeout"] = config_data["IdleTimeout"]
+            else:
+                self.config["IdleTimeout"] = default_idle_timeout
+            if "IdleAction" in config_data.keys() and config_data["IdleAction"] in ["terminate", "stop"]:
+                self.config["IdleAction"] = config_data["IdleAction"]
+            else:
+                self.config["IdleAction"] = "terminate"
+            if "RegistryMirror" in config_data.keys():
+                self.config["RegistryMirror"] = config_data["RegistryMirror"]
+            else:
+                self.config["RegistryMirror"] = None
             if "AdditionalPorts" in config_data.keys():
                 self.config["AdditionalPorts"] = config_data["AdditionalPorts"]
                 if "8080" not in self.config["AdditionalPorts"]:
@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import logging as log
+from config import get_home
+from cache import atomic_write_json
+
+# Docker CLI context store: contexts/meta/<sha256 of name>/meta.json and contexts/tls/<sha256 of name>/docker/*.pem
+default_context = "default"
+
+
+def get_docker_config_dir():
+    return os.getenv("DOCKER_CONFIG") or f"{get_home()}/.docker"
+
+
+def get_context_name(instance_type, instance_id):
+    return f"{instance_type}_{instance_id}"
+
+
+def get_context_id(name):
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def write_file(filename, data, mode=0o644):
+    """
+    Write file through a temporary file in the same folder, the Docker CLI never reads a partial file
+    """
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.chmod(tmp_filename, mode)
+        os.replace(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def create_context(name, host, cert_path):
+    """
+    Create (or replace) a docker context using TLS material from cert_path, same as
+    `docker context create <name> --docker host=<host>,ca=...,cert=...,key=...`
+    """
+    config_dir = get_docker_config_dir()
+    context_id = get_context_id(name)
+    tls_dir = f"{config_dir}/contexts/tls/{context_id}/docker"
+    for source, target, mode in [
+        ("ca/cert.pem", "ca.pem", 0o644),
+        ("client/cert.pem", "cert.pem", 0o644),
+        ("client/key.pem", "key.pem", 0o600)
+    ]:
+        with open(os.path.join(cert_path, source), "rb") as file:
+            write_file(f"{tls_dir}/{target}", file.read(), mode)
+    meta = {
+        "Name": name,
+        "Metadata": {"Description": "sdocker host"},
+        "Endpoints": {"docker": {"Host": host, "SkipTLSVerify": False}}
+    }
+    write_file(f"{config_dir}/contexts/meta/{context_id}/meta.json", json.dumps(meta).encode())
+    log.info(f"Created docker context {name} for {host}")
+
+
+def remove_contexts(names):
+    """
+    Remove docker contexts, switching back to the default context when the current one is removed
+    """
+    config_dir = get_docker_config_dir()
+    if current_context() in names:
+        use_context(default_context)
+    for name in names:
+        context_id = get_context_id(name)
+        shutil.rmtree(f"{config_dir}/contexts/meta/{context_id}", ignore_errors=True)
+        shutil.rmtree(f"{config_dir}/contexts/tls/{context_id}", ignore_errors=True)
+        log.info(f"Removed docker context {name}")
+
+
+def list_contexts():
+    """
+    Names of contexts in the context store, the default context is implicit and not listed
+    """
+    meta_dir = f"{get_docker_config_dir()}/contexts/meta"
+    names = []
+    if not os.path.isdir(meta_dir):
+        return names
+    for context_id in os.listdir(meta_dir):
+        try:
+            with open(f"{meta_dir}/{context_id}/meta.json", "r") as file:
+                names.append(json.load(file)["Name"])
+        except (OSError, ValueError, KeyError):
+            log.info(f"Skipping unreadable docker context {context_id}")
+    return names
+
+
+def context_exists(name):
+    return name == default_context or os.path.exists(f"{get_docker_config_dir()}/contexts/meta/{get_context_id(name)}/meta.json")
+
+
+def read_docker_config(config_file):
+    """
+    Docker CLI config.json, an unreadable file raises instead of being overwritten
+    """
+    try:
+        with open(config_file, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def current_context():
+    return read_docker_config(f"{get_docker_config_dir()}/config.json").get("currentContext", default_context)
+
+
+def use_context(name):
+    """
+    Set currentContext in config.json, other settings (auths, credential helpers, ...) are kept
+    """
+    if not context_exists(name):
+        raise ValueError(f"Docker context {name} does not exist")
+    config_file = f"{get_docker_config_dir()}/config.json"
+    config = read_docker_config(config_file)
+    if name == default_context:
+        config.pop("currentContext", None)
+    else:
+        config["currentContext"] = name
+    atomic_write_json(config_file, config)
+    log.info(f"Switched docker context to {name}")
@@ -0,0 +1,73 @@
+import time
+import logging as log
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+max_workers = 8
+
+
+def run_task_graph(tasks, workers=max_workers):
+    """
+    Run tasks on a thread pool as soon as their dependencies are done.
+    tasks: {name: (list of dependency names, function)}, each function is called with a dict of
+    its dependencies results.
+    Returns (results, timings), timings is a list of {"Name", "Start", "Duration"} in seconds
+    relative to the graph start.
+    """
+    for name, (deps, _) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+    results = {}
+    timings = []
+    running = {}
+    pending = dict(tasks)
+    graph_start = time.perf_counter()
+
+    def timed(name, function, inputs):
+        start = time.perf_counter()
+        try:
+            return function(inputs)
+        finally:
+            timings.append({
+                "Name": name,
+                "Start": round(start - graph_start, 3),
+                "Duration": round(time.perf_counter() - start, 3)
+            })
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [name for name, (deps, _) in pending.items() if all(dep in results for dep in deps)]
+            for name in ready:
+                deps, function = pending.pop(name)
+                inputs = {dep: results[dep] for dep in deps}
+                running[executor.submit(timed, name, function, inputs)] = name
+            if not running:
+                raise ValueError(f"Circular dependency between tasks {list(pending.keys())}")
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error:
+                    for other in running:
+                        other.cancel()
+                    raise error
+                results[name] = future.result()
+    wall_time = round(time.perf_counter() - graph_start, 3)
+    timings.sort(key=lambda timing: timing["Start"])
+    timings.append({"Name": "Total", "Start": 0, "Duration": wall_time})
+    return results, timings
+
+
+def format_timings(timings):
+    """
+    Timing report comparing wall-clock time with the sum of all calls (serial time)
+    """
+    calls = [timing for timing in timings if timing["Name"] != "Total"]
+    serial_time = sum(timing["Duration"] for timing in calls)
+    wall_time = sum(timing["Duration"] for timing in timings if timing["Name"] == "Total")
+    width = max([len(timing["Name"]) for timing in calls] + [10])
+    lines = [f"{'Call':<{width}}  {'Start(s)':>8}  {'Duration(s)':>11}"]
+    for timing in calls:
+        lines.append(f"{timing['Name']:<{width}}  {timing['Start']:>8.3f}  {timing['Duration']:>11.3f}")
+    lines.append(f"Wall-clock: {wall_time:.3f}s, serial: {serial_time:.3f}s")
+    return "\n".join(lines)
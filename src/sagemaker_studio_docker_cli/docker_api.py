@@ -0,0 +1,132 @@
+import sys
+import time
+import threading
+import logging as log
+
+connect_timeout = 3
+read_timeout = 30
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_cert_path(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/certs/"
+
+
+class DockerClient():
+    """
+    Minimal Docker Engine API client over mTLS.
+    Uses a persistent requests.Session so connections (and TLS sessions) are kept alive between calls.
+    """
+    def __init__(self, home, instance_type, instance_id, dns, port):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        path_to_cert = get_cert_path(home, instance_type, instance_id)
+        self.base_url = f"https://{dns}:{port}"
+        self.session = requests.Session()
+        self.session.cert = (path_to_cert + "client/cert.pem", path_to_cert + "client/key.pem")
+        self.session.verify = path_to_cert + "ca/cert.pem"
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+
+    def request(self, method, path, timeout=(connect_timeout, read_timeout), **kwargs):
+        response = self.session.request(method, self.base_url + path, timeout=timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def ping(self):
+        """
+        Liveness check, /_ping returns "OK" without building a full response body
+        """
+        return self.request("GET", "/_ping", timeout=(connect_timeout, 5)).text == "OK"
+
+    def version(self):
+        return self.request("GET", "/version").json()
+
+    def info(self):
+        return self.request("GET", "/info").json()
+
+    def image_exists(self, image):
+        import requests
+
+        try:
+            self.request("GET", f"/images/{image}/json")
+            return True
+        except requests.HTTPError as error:
+            if error.response.status_code == 404:
+                return False
+            raise
+
+    def pull(self, image):
+        """
+        Pull image on the host, response is streamed until the pull completes
+        """
+        response = self.request("POST", "/images/create", params={"fromImage": image}, stream=True, timeout=(connect_timeout, None))
+        for _ in response.iter_lines():
+            pass
+
+    def run(self, spec, output=None):
+        """
+        Create and start a container (spec as in POST /containers/create, with Tty so output is not multiplexed),
+        stream its output (to sys.stdout by default) until it exits and remove it. Returns container exit code
+        """
+        output = output or sys.stdout
+        container_id = self.request("POST", "/containers/create", json=spec).json()["Id"]
+        try:
+            self.request("POST", f"/containers/{container_id}/start")
+            logs = self.request(
+                "GET",
+                f"/containers/{container_id}/logs",
+                params={"follow": 1, "stdout": 1, "stderr": 1},
+                stream=True,
+                timeout=(connect_timeout, None)
+            )
+            for chunk in logs.iter_content(chunk_size=None):
+                output.write(chunk.decode(errors="replace"))
+                output.flush()
+            return self.request("POST", f"/containers/{container_id}/wait", timeout=(connect_timeout, None)).json()["StatusCode"]
+        finally:
+            self.request("DELETE", f"/containers/{container_id}", params={"force": 1})
+
+    def close(self):
+        self.session.close()
+
+
+def get_client(home, instance_type, instance_id, dns, port):
+    """
+    Shared client per host, reused by every caller in the process
+    """
+    key = (instance_id, dns, port)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = DockerClient(home, instance_type, instance_id, dns, port)
+        return _clients[key]
+
+
+def close_other_clients(instance_ids):
+    """
+    Drop pooled connections of hosts not in instance_ids, eg. terminated hosts in a long-lived agent
+    """
+    with _clients_lock:
+        for key in [key for key in _clients if key[0] not in instance_ids]:
+            _clients.pop(key).close()
+
+
+def pooled_hosts():
+    with _clients_lock:
+        return sorted({key[0] for key in _clients})
+
+
+def benchmark(client, count=5):
+    """
+    Latency of the first /_ping (TCP and TLS handshake) and of the following pings on the kept-alive connection.
+    Returns (first latency, list of keep-alive latencies) in seconds
+    """
+    client.close()
+    latencies = []
+    for _ in range(count + 1):
+        start = time.perf_counter()
+        client.ping()
+        latencies.append(time.perf_counter() - start)
+    log.info(f"Ping latencies for {client.base_url}: {latencies}")
+    return latencies[0], latencies[1:]
@@ -0,0 +1,134 @@
+import os
+import copy
+import time
+import fcntl
+import logging as log
+from contextlib import contextmanager
+from config import get_home
+from cache import load_cache, atomic_write_json
+
+refresh_ttl = 30
+removed_states = ["terminated"]
+
+
+class HostRegistry():
+    """
+    Registry of Docker Hosts in ~/.sagemaker_studio_docker_cli/sdocker-hosts.conf
+    {
+        "ActiveHosts": [{"InstanceId", "InstanceDns", "Port", "InstanceType", "ImageId", "State"}, ...],
+        "CurrentHost": instance id used by current docker context,
+        "LastRefresh": time of last instance state refresh
+    }
+    Current host is kept first in ActiveHosts for tools reading ActiveHosts[0].
+    Updates hold a POSIX lock (fcntl, supported by NFSv4 on EFS) and replace the file atomically.
+    Parsed registry is kept until the file changes, so a long-lived agent does not parse it on every command.
+    """
+    def __init__(self):
+        self.filename = f"{get_home()}/.sagemaker_studio_docker_cli/sdocker-hosts.conf"
+        self.lock_filename = f"{self.filename}.lock"
+        self.loaded = None
+        self.loaded_state = None
+
+    def read(self, fresh=False):
+        try:
+            stat = os.stat(self.filename)
+            state = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            state = None
+        if fresh or state is None or state != self.loaded_state:
+            self.loaded = load_cache(self.filename)
+            self.loaded_state = state
+        data = copy.deepcopy(self.loaded)
+        data.setdefault("ActiveHosts", [])
+        if "CurrentHost" not in data.keys():
+            data["CurrentHost"] = data["ActiveHosts"][0]["InstanceId"] if len(data["ActiveHosts"]) > 0 else None
+        return data
+
+    @contextmanager
+    def update(self):
+        """
+        Locked read-modify-write of the registry
+        """
+        os.makedirs(os.path.dirname(self.lock_filename), exist_ok=True)
+        with open(self.lock_filename, "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                data = self.read(fresh=True)
+                yield data
+                ids = [host["InstanceId"] for host in data["ActiveHosts"]]
+                if data["CurrentHost"] not in ids:
+                    data["CurrentHost"] = ids[0] if len(ids) > 0 else None
+                data["ActiveHosts"].sort(key=lambda host: host["InstanceId"] != data["CurrentHost"])
+                atomic_write_json(self.filename, data)
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+    def hosts(self):
+        return self.read()["ActiveHosts"]
+
+    def get_host(self, instance_id):
+        for host in self.hosts():
+            if host["InstanceId"] == instance_id:
+                return host
+        return None
+
+    def current_host(self):
+        data = self.read()
+        for host in data["ActiveHosts"]:
+            if host["InstanceId"] == data["CurrentHost"]:
+                return host
+        return None
+
+    def add_hosts(self, hosts, make_current=True):
+        with self.update() as data:
+            ids = [host["InstanceId"] for host in hosts]
+            data["ActiveHosts"] = [host for host in data["ActiveHosts"] if host["InstanceId"] not in ids] + hosts
+            if make_current and len(hosts) > 0:
+                data["CurrentHost"] = hosts[0]["InstanceId"]
+
+    def remove_hosts(self, instance_ids):
+        with self.update() as data:
+            data["ActiveHosts"] = [host for host in data["ActiveHosts"] if host["InstanceId"] not in instance_ids]
+
+    def set_current(self, instance_id):
+        with self.update() as data:
+            if instance_id not in [host["InstanceId"] for host in data["ActiveHosts"]]:
+                raise ValueError(f"Host {instance_id} is not registered in {self.filename}")
+            data["CurrentHost"] = instance_id
+
+    def set_state(self, instance_ids, state):
+        with self.update() as data:
+            for host in data["ActiveHosts"]:
+                if host["InstanceId"] in instance_ids:
+                    host["State"] = state
+
+    def refresh(self, ec2_client, force=False):
+        """
+        Refresh instance state of all registered hosts with a single describe_instances call,
+        skipped when last refresh is younger than refresh_ttl. Terminated or missing hosts are pruned.
+        """
+        data = self.read()
+        if len(data["ActiveHosts"]) == 0:
+            return data["ActiveHosts"]
+        if not force and time.time() - data.get("LastRefresh", 0) < refresh_ttl:
+            return data["ActiveHosts"]
+        ids = [host["InstanceId"] for host in data["ActiveHosts"]]
+        states = {}
+        # filters, unlike InstanceIds, do not fail when one of the instances no longer exists
+        paginator = ec2_client.get_paginator("describe_instances")
+        for page in paginator.paginate(Filters=[{"Name": "instance-id", "Values": ids}]):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    states[instance["InstanceId"]] = instance["State"]["Name"]
+        with self.update() as data:
+            hosts = []
+            for host in data["ActiveHosts"]:
+                state = states.get(host["InstanceId"])
+                if state is None or state in removed_states:
+                    log.info(f"Pruning host {host['InstanceId']} from registry, state: {state}")
+                    continue
+                host["State"] = state
+                hosts.append(host)
+            data["ActiveHosts"] = hosts
+            data["LastRefresh"] = time.time()
+        return self.hosts()
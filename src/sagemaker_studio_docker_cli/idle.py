@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import logging as log
+
+idle_check_interval = 60
+# CPU and GPU utilisation (percent) above which a host is busy
+idle_cpu_threshold = 10
+idle_gpu_threshold = 5
+# bytes received by the dind network namespace per check above which the docker API is in use,
+# TCP keep-alive probes of idle client connections stay well below it
+idle_api_bytes_threshold = 16384
+
+# Written by sdocker to the host folder on EFS at launch (like certificates, it would not fit in the 16 KB of user data),
+# the bootstrap script installs it as /usr/local/bin/sdocker-idle-monitor and runs it as a transient systemd unit.
+# Activity is any of: new connections accepted or data received in the dind network namespace (docker API use,
+# pulls, published ports), running containers in the dind daemon, CPU or GPU utilisation above thresholds.
+# After IDLE_TIMEOUT seconds without activity a final report is written to dockerd-logs and the host shuts down,
+# which stops or terminates it depending on its InstanceInitiatedShutdownBehavior.
+idle_monitor_script = r"""#!/bin/bash
+DIND="docker exec dockerd-server docker --tlsverify --tlscacert=/certs/ca/cert.pem --tlscert=/certs/client/cert.pem --tlskey=/certs/client/key.pem -H=tcp://localhost:2376"
+STARTED=$(date +%s)
+LAST_ACTIVE=$STARTED
+
+read_cpu() {
+    awk '/^cpu / {print $2 + $3 + $4 + $7 + $8 + $9, $2 + $3 + $4 + $5 + $6 + $7 + $8 + $9}' /proc/stat
+}
+
+read_network() {
+    # accepted connections and received bytes of the dind network namespace
+    PID=$(docker inspect -f '{{.State.Pid}}' dockerd-server 2> /dev/null)
+    if [ -z "$PID" ] || [ "$PID" == "0" ]
+    then
+        echo "0 0"
+        return
+    fi
+    echo "$(awk '/^Tcp:/ {if (header) print $7; header = 1}' /proc/$PID/net/snmp) $(awk '/^IpExt:/ {if (!column) {for (i = 1; i <= NF; i++) if ($i == "InOctets") column = i} else print $column}' /proc/$PID/net/netstat)"
+}
+
+write_status() {
+    cat > $LOG_DIR/$1.tmp << STATUS
+{"InstanceId": "$INSTANCE_ID", "InstanceType": "$INSTANCE_TYPE", "IdleTimeout": $IDLE_TIMEOUT, "IdleAction": "$IDLE_ACTION", "IdleSeconds": $IDLE, "LastActive": $LAST_ACTIVE, "Updated": $NOW, "Started": $STARTED, "Activity": "${ACTIVITY# }", "RunningContainers": $RUNNING, "CpuPercent": $CPU, "GpuPercent": $GPU}
+STATUS
+    mv $LOG_DIR/$1.tmp $LOG_DIR/$1
+    chown $OWNER_UID:1001 $LOG_DIR/$1
+}
+
+set -- $(read_cpu)
+CPU_BUSY=$1
+CPU_TOTAL=$2
+set -- $(read_network)
+PASSIVE_OPENS=$1
+IN_OCTETS=$2
+while true
+do
+    sleep $CHECK_INTERVAL
+    NOW=$(date +%s)
+    ACTIVITY=""
+
+    set -- $(read_network)
+    [ "${1:-0}" != "$PASSIVE_OPENS" ] && ACTIVITY="$ACTIVITY api"
+    [ $(( ${2:-0} - IN_OCTETS )) -gt $API_BYTES_THRESHOLD ] && ACTIVITY="$ACTIVITY network"
+
+    RUNNING=$($DIND ps -q 2> /dev/null | wc -l)
+    [ "$RUNNING" -gt 0 ] && ACTIVITY="$ACTIVITY containers"
+
+    # counters are read again after `ps`, its own connection to the daemon is not activity
+    set -- $(read_network)
+    PASSIVE_OPENS=${1:-0}
+    IN_OCTETS=${2:-0}
+
+    set -- $(read_cpu)
+    CPU=$(awk "BEGIN {total = $2 - $CPU_TOTAL; print (total > 0) ? int(100 * ($1 - $CPU_BUSY) / total) : 0}")
+    CPU_BUSY=$1
+    CPU_TOTAL=$2
+    [ "$CPU" -gt $CPU_THRESHOLD ] && ACTIVITY="$ACTIVITY cpu"
+
+    GPU=0
+    if command -v nvidia-smi &> /dev/null
+    then
+        GPU=$(nvidia-smi --query-gpu=utilization.gpu --format=csv,noheader,nounits 2> /dev/null | sort -n | tail -1)
+        GPU=${GPU:-0}
+        [ "$GPU" -gt $GPU_THRESHOLD ] && ACTIVITY="$ACTIVITY gpu"
+    fi
+
+    [ -n "$ACTIVITY" ] && LAST_ACTIVE=$NOW
+    IDLE=$(( NOW - LAST_ACTIVE ))
+    write_status idle.json
+    if [ $IDLE -ge $IDLE_TIMEOUT ]
+    then
+        echo "Host idle for ${IDLE}s, shutting down ($IDLE_ACTION)"
+        write_status idle-report.json
+        log_path=$(docker inspect -f '{{.LogPath}}' dockerd-server 2> /dev/null)
+        [ -n "$log_path" ] && cp $log_path $LOG_DIR/dockerd.log
+        cp /var/log/user-data.log $LOG_DIR/bootstrap.log
+        chown $OWNER_UID:1001 $LOG_DIR/dockerd.log $LOG_DIR/bootstrap.log
+        sync
+        shutdown -h now
+        exit 0
+    fi
+done
+"""
+
+
+def get_idle_monitor_filename(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/idle-monitor.sh"
+
+
+def write_idle_monitor(home, instance_type, instance_id):
+    """
+    Write the idle monitor script to the host folder on EFS, the bootstrap script copies it once certificates are there
+    """
+    filename = get_idle_monitor_filename(home, instance_type, instance_id)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f"{filename}.tmp", "w") as file:
+        file.write(idle_monitor_script)
+    os.replace(f"{filename}.tmp", filename)
+    return filename
+
+
+def get_idle_filename(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/dockerd-logs/idle.json"
+
+
+def get_idle_report_filename(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/dockerd-logs/idle-report.json"
+
+
+def read_idle_status(home, instance_type, instance_id):
+    """
+    Last idle monitor status of host, None when the host runs no idle monitor (yet)
+    """
+    try:
+        with open(get_idle_filename(home, instance_type, instance_id), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as error:
+        log.info(f"Ignoring unreadable idle status of {instance_id}: {error}")
+        return None
+
+
+def idle_remaining(status, now=None):
+    """
+    Seconds left before the idle monitor shuts the host down, None when its status is stale (monitor not running)
+    """
+    now = now or time.time()
+    if now - status["Updated"] > 3 * idle_check_interval:
+        return None
+    return max(0, status["IdleTimeout"] - (now - status["LastActive"]))
+
+
+def format_idle(status, state=None):
+    if status is None or state not in [None, "running"]:
+        return "-"
+    remaining = idle_remaining(status)
+    if remaining is None:
+        return "-"
+    idle = f"{status['IdleAction']} in {remaining / 60:.0f}m"
+    if status["IdleSeconds"] == 0 and status.get("Activity"):
+        idle += f" (active: {status['Activity']})"
+    return idle
@@ -0,0 +1,78 @@
+import time
+import logging as log
+
+# errors that depend on capacity in an availability zone or market, the next subnet or market is tried
+capacity_errors = [
+    "InsufficientInstanceCapacity",
+    "InsufficientHostCapacity",
+    "InsufficientCapacity",
+    "InsufficientFreeAddressesInSubnet",
+    "Unsupported",
+    "MaxSpotInstanceCountExceeded",
+    "SpotMaxPriceTooLow"
+]
+spot_options = {
+    "MarketType": "spot",
+    "SpotOptions": {
+        "SpotInstanceType": "one-time",
+        "InstanceInterruptionBehavior": "terminate"
+    }
+}
+
+
+class LaunchError(Exception):
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+def plan_subnets(instance_type_info, subnet_ids, subnet_azs):
+    """
+    Keep subnets whose availability zone offers instance type, in domain subnet order.
+    instance_type_info: instance type catalog entry, with the availability zones offering it
+    """
+    instance_type = instance_type_info["InstanceType"]
+    offered_azs = set(instance_type_info["AvailabilityZones"])
+    subnets = [subnet_id for subnet_id in subnet_ids if subnet_azs.get(subnet_id) in offered_azs]
+    log.info(f"{instance_type} is offered in {sorted(offered_azs)}, candidate subnets: {subnets}")
+    if len(subnets) == 0:
+        raise LaunchError(f"{instance_type} is not offered in any availability zone of subnets {subnet_ids}", [])
+    return subnets
+
+
+def launch_with_fallback(ec2_client, args, subnets, subnet_azs, spot=False):
+    """
+    Call run_instances on each subnet in turn until capacity is found. With spot, Spot capacity is
+    tried in every subnet before falling back to on-demand.
+    Returns (run_instances response, attempts), each attempt records subnet, AZ, market, duration and error.
+    """
+    attempts = []
+    markets = ["spot", "on-demand"] if spot else ["on-demand"]
+    for market in markets:
+        for subnet_id in subnets:
+            launch_args = {**args, "SubnetId": subnet_id}
+            if market == "spot":
+                launch_args["InstanceMarketOptions"] = spot_options
+                # one-time Spot instances cannot be stopped, hosts shutting down when idle are terminated
+                if "InstanceInitiatedShutdownBehavior" in launch_args:
+                    launch_args["InstanceInitiatedShutdownBehavior"] = "terminate"
+            attempt = {
+                "SubnetId": subnet_id,
+                "AvailabilityZone": subnet_azs.get(subnet_id),
+                "Market": market
+            }
+            start = time.perf_counter()
+            try:
+                response = ec2_client.run_instances(**launch_args)
+                attempt["Duration"] = round(time.perf_counter() - start, 3)
+                attempts.append(attempt)
+                log.info(f"Launch attempt {len(attempts)} succeeded: {attempt}")
+                return response, attempts
+            except ec2_client.exceptions.ClientError as error:
+                attempt["Duration"] = round(time.perf_counter() - start, 3)
+                attempt["Error"] = error.response["Error"]["Code"]
+                attempts.append(attempt)
+                if attempt["Error"] not in capacity_errors:
+                    raise
+                log.info(f"Launch attempt {len(attempts)} failed: {attempt}")
+    raise LaunchError(f"No capacity found for {args['InstanceType']} after {len(attempts)} attempts", attempts)
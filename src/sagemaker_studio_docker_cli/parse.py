@@ -4,23 +4,105 @@ class ParseArgs():
     """
     Parsing Arguments class
     """
-    def __init__(self):
+    def __init__(self, argv=None):
         """
+        Sub arguments are (name, required) or (name, required, extra add_argument options).
+        argv defaults to the command line, the agent parses arguments forwarded by the CLI
         """
         parser = argparse.ArgumentParser(prog="sagemaker_studio_docker_cli")
+        parser.add_argument("--refresh-config", action="store_true",
+                            help="Ignore cached configuration and rediscover SageMaker Studio, EFS and EC2 resources")
         commands = [
             "create-host",
             "terminate-current-host",
-            "terminate-host"
+            "terminate-host",
+            "config",
+            "pool",
+            "stop-host",
+            "start-host",
+            "list-hosts",
+            "use-host",
+            "describe-host",
+            "ping-host",
+            "bake-ami",
+            "timings",
+            "build",
+            "wait",
+            "watch-host",
+            "agent"
         ]
         sub_args = {
             "create-host": [
-                ("--instance-type", True),
-                ("--subnet-id", False)
+                ("--instance-type", False),
+                ("--cpus", False, {"type": int}),
+                ("--memory", False, {"type": float}),
+                ("--gpus", False, {"type": int}),
+                ("--subnet-id", False),
+                ("--count", False, {"type": int, "default": 1}),
+                ("--spot", False, {"action": "store_true"}),
+                ("--no-instance-store", False, {"action": "store_true"}),
+                ("--no-wait", False, {"action": "store_true"})
             ],
             "terminate-current-host": [],
             "terminate-host": [
+                ("instance_ids", False, {"nargs": "*"}),
+                ("--instance-id", False, {"action": "append", "default": []}),
+                ("--all", False, {"action": "store_true"}),
+                ("--stale", False, {"action": "store_true"})
+            ],
+            "config": [
+                ("action", True, {"choices": ["show", "refresh"]})
+            ],
+            "pool": [
+                ("action", True, {"choices": ["fill", "status"]}),
+                ("--instance-type", False),
+                ("--size", False, {"type": int, "default": 1}),
+                ("--subnet-id", False),
+                ("--no-instance-store", False, {"action": "store_true"})
+            ],
+            "stop-host": [
+                ("--instance-id", False)
+            ],
+            "start-host": [
                 ("--instance-id", True)
+            ],
+            "list-hosts": [
+                ("--refresh", False, {"action": "store_true"})
+            ],
+            "use-host": [
+                ("--instance-id", True)
+            ],
+            "describe-host": [
+                ("--instance-id", False)
+            ],
+            "ping-host": [
+                ("--instance-id", False),
+                ("--count", False, {"type": int, "default": 5})
+            ],
+            "bake-ami": [
+                ("--instance-type", False, {"default": "m5.xlarge"}),
+                ("--subnet-id", False)
+            ],
+            "timings": [
+                ("instance_id", False, {"nargs": "?"})
+            ],
+            "build": [
+                ("context", False, {"nargs": "?", "default": "."}),
+                ("--tag", False, {"action": "append", "default": []}),
+                ("--file", False),
+                ("--build-arg", False, {"action": "append", "default": []}),
+                ("--target", False),
+                ("--cache", False, {"choices": ["efs", "local", "none"], "default": "efs"}),
+                ("--instance-id", False)
+            ],
+            "wait": [
+                ("instance_ids", False, {"nargs": "*"})
+            ],
+            "watch-host": [
+                ("instance_ids", False, {"nargs": "+"})
+            ],
+            "agent": [
+                ("action", True, {"choices": ["start", "stop", "status", "run"]})
             ]
         }
         command_parser = parser.add_subparsers(title="commands", dest=str(commands), required=True)
@@ -28,8 +110,12 @@ class ParseArgs():
         for command in commands:
             arg_commands[command] = command_parser.add_parser(command)
             arg_commands[command].set_defaults(func=command)
-            for sub_arg, required in sub_args[command]:
-                arg_commands[command].add_argument(sub_arg, required=required)
-        args = parser.parse_args()
+            for sub_arg in sub_args[command]:
+                name, required = sub_arg[0], sub_arg[1]
+                options = sub_arg[2] if len(sub_arg) > 2 else {}
+                if name.startswith("-"):
+                    options = {"required": required, **options}
+                arg_commands[command].add_argument(name, **options)
+        args = parser.parse_args(argv)
         self.parser = parser
         self.args = args
@@ -0,0 +1,151 @@
+import time
+import logging as log
+from docker_api import get_client
+
+timeout = 720
+initial_wait = 0.5
+max_wait = 5
+backoff_factor = 1.5
+state_check_interval = 15
+terminal_states = ["shutting-down", "terminated"]
+
+
+def ping_host(home, instance_type, instance_id, dns, port, retry=True):
+    """
+    Check Docker host health with /_ping on the pooled client of the host
+    """
+    try:
+        log.info(f"Pinging {dns}")
+        get_client(home, instance_type, instance_id, dns, port).ping()
+        log.info(f"DockerHost {dns} is healthy!")
+        return (True, None)
+    except Exception as error:
+        if retry:
+            log.info(f"Failed to reach {dns}:{port}, retrying")
+        else:
+            log.error(f"Failed to reach {dns}:{port}, with error message {error}")
+        return (False, error)
+
+
+def backoff():
+    """
+    Delays between checks, growing from initial_wait to max_wait
+    """
+    wait = initial_wait
+    while True:
+        yield wait
+        wait = min(wait * backoff_factor, max_wait)
+
+
+def get_certs_loaded_filename(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/dockerd-logs/certs-loaded"
+
+
+class HostNotReady(Exception):
+    pass
+
+
+class HostReadiness():
+    """
+    Readiness state machine for a Docker Host, phases run in order:
+        InstanceRunning: EC2 instance state is running
+        CertsReady: bootstrap of the current boot has picked up the host certificates from EFS
+        DaemonReady: docker daemon answers over mTLS
+    Terminal instance states fail immediately instead of waiting for the timeout.
+    progress is called with the name of each phase when it starts.
+    """
+    def __init__(self, ec2_client, home, instance_type, instance_id, dns, port, timeout=timeout, progress=None):
+        self.ec2_client = ec2_client
+        self.home = home
+        self.instance_type = instance_type
+        self.instance_id = instance_id
+        self.dns = dns
+        self.port = port
+        self.deadline = time.time() + timeout
+        self.timings = {}
+        self.seen_running = False
+        self.last_state_check = 0
+        self.launch_time = None
+        self.error = None
+        self.progress = progress
+
+    def instance_state(self):
+        """
+        Current EC2 state name and reason, instance may not be visible right after run_instances
+        """
+        try:
+            response = self.ec2_client.describe_instances(InstanceIds=[self.instance_id])
+        except self.ec2_client.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] == "InvalidInstanceID.NotFound":
+                return ("pending", None)
+            raise
+        instance = response["Reservations"][0]["Instances"][0]
+        # LaunchTime is updated when a stopped instance is started
+        self.launch_time = instance["LaunchTime"].timestamp()
+        reason = instance.get("StateReason", {}).get("Message")
+        return (instance["State"]["Name"], reason)
+
+    def check_state(self, force=False):
+        """
+        Raise HostNotReady when instance reached a terminal state, rate limited unless forced
+        """
+        if not force and time.time() - self.last_state_check < state_check_interval:
+            return None
+        self.last_state_check = time.time()
+        state, reason = self.instance_state()
+        if state == "running":
+            self.seen_running = True
+        # a starting instance is still reported as stopped for a short time
+        if state in terminal_states or (self.seen_running and state in ["stopping", "stopped"]):
+            raise HostNotReady(f"Instance {self.instance_id} is {state}: {reason}")
+        return state
+
+    def wait_for(self, phase, check):
+        """
+        Run check with adaptive backoff until it returns True, record phase duration
+        """
+        start = time.time()
+        if self.progress:
+            self.progress(phase)
+        for wait in backoff():
+            if check():
+                break
+            if time.time() + wait > self.deadline:
+                raise HostNotReady(f"Timed out in phase {phase}")
+            time.sleep(wait)
+        self.timings[phase] = round(time.time() - start, 1)
+        log.info(f"Host {self.instance_id} phase {phase} done in {self.timings[phase]}s")
+
+    def certs_ready(self):
+        """
+        The bootstrap writes the time it loaded the certificates to dockerd-logs/certs-loaded, a marker written
+        before the last (re)start of the instance belongs to a previous boot
+        """
+        self.check_state()
+        try:
+            with open(get_certs_loaded_filename(self.home, self.instance_type, self.instance_id), "r") as file:
+                loaded = float(file.read().strip())
+        except (FileNotFoundError, ValueError):
+            return False
+        return self.launch_time is not None and loaded >= self.launch_time
+
+    def daemon_ready(self):
+        self.check_state()
+        healthy, self.error = ping_host(self.home, self.instance_type, self.instance_id, self.dns, self.port)
+        return healthy
+
+    def wait(self):
+        """
+        Returns (healthy, error), per-phase timings are kept in self.timings
+        """
+        try:
+            self.wait_for("InstanceRunning", lambda: self.check_state(force=True) == "running")
+            self.wait_for("CertsReady", self.certs_ready)
+            self.wait_for("DaemonReady", self.daemon_ready)
+            return (True, None)
+        except HostNotReady as error:
+            log.error(f"Host {self.instance_id} is not ready: {error}, last ping error: {self.error}")
+            return (False, error)
+
+    def format_timings(self):
+        return ", ".join(f"{phase} {duration}s" for phase, duration in self.timings.items())
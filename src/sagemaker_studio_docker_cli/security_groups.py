@@ -0,0 +1,73 @@
+import logging as log
+
+
+def describe_groups(ec2_client, vpc_id, names):
+    """
+    Look up security groups by name in VPC with a single call, returns {name: group id} of groups found
+    """
+    response = ec2_client.describe_security_groups(
+        Filters=[
+            {"Name": "group-name", "Values": names},
+            {"Name": "vpc-id", "Values": [vpc_id]}
+        ]
+    )
+    return {group["GroupName"]: group["GroupId"] for group in response["SecurityGroups"]}
+
+
+def ignore_existing(ec2_client, operation, **kwargs):
+    """
+    Call a rule API, rules that are already present (or already revoked) are not an error
+    """
+    try:
+        getattr(ec2_client, operation)(**kwargs)
+    except ec2_client.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] not in ["InvalidPermission.Duplicate", "InvalidPermission.NotFound"]:
+            raise
+
+
+def create_group(ec2_client, vpc_id, name, description, source_sg, from_port, to_port, revoke_egress=False):
+    """
+    Create security group and its rules. When another sdocker process created the group first its id is
+    looked up, rules are applied either way so a group left without rules by an interrupted process is fixed
+    """
+    try:
+        group_id = ec2_client.create_security_group(Description=description, GroupName=name, VpcId=vpc_id)["GroupId"]
+        log.info(f"Created {name} security group {group_id}")
+    except ec2_client.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] != "InvalidGroup.Duplicate":
+            raise
+        group_id = describe_groups(ec2_client, vpc_id, [name])[name]
+        log.info(f"Security group {name} was created concurrently, using {group_id}")
+    permissions = [{
+        "FromPort": from_port,
+        "IpProtocol": "tcp",
+        "ToPort": to_port,
+        "UserIdGroupPairs": [{
+            "Description": description,
+            "GroupId": group_id if source_sg == "self" else source_sg
+        }]
+    }]
+    if revoke_egress:
+        ignore_existing(
+            ec2_client,
+            "revoke_security_group_egress",
+            GroupId=group_id,
+            IpPermissions=[{"IpProtocol": "-1", "IpRanges": [{"CidrIp": "0.0.0.0/0"}]}]
+        )
+        ignore_existing(ec2_client, "authorize_security_group_egress", GroupId=group_id, IpPermissions=permissions)
+    ignore_existing(ec2_client, "authorize_security_group_ingress", GroupId=group_id, IpPermissions=permissions)
+    return group_id
+
+
+def resolve_security_groups(ec2_client, vpc_id, groups):
+    """
+    Resolve all groups with one describe call and create the missing ones.
+    groups: {name: (description, source security group id or "self", from port, to port, revoke egress)}
+    Returns {name: group id}
+    """
+    group_ids = describe_groups(ec2_client, vpc_id, list(groups))
+    log.info(f"Found security groups {group_ids}")
+    for name, spec in groups.items():
+        if name not in group_ids:
+            group_ids[name] = create_group(ec2_client, vpc_id, name, *spec)
+    return group_ids
@@ -0,0 +1,163 @@
+import json
+import math
+import time
+import logging as log
+from config import get_home
+
+
+def get_launch_timings_filename():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/launch-timings.jsonl"
+
+
+def get_bootstrap_timings_filename(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/dockerd-logs/bootstrap-timings.jsonl"
+
+
+def get_docker_volume_filename(home, instance_type, instance_id):
+    return f"{home}/.sagemaker_studio_docker_cli/{instance_type}_{instance_id}/dockerd-logs/docker-volume.json"
+
+
+def record_launch(record):
+    """
+    Append client side timings of a launch, one json document per line
+    """
+    try:
+        with open(get_launch_timings_filename(), "a") as file:
+            file.write(json.dumps({"Time": time.time(), **record}) + "\n")
+    except Exception as error:
+        log.error(f"Failed to record launch timings: {error}")
+
+
+def read_jsonl(filename):
+    records = []
+    try:
+        with open(filename, "r") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    log.info(f"Skipping malformed line in {filename}")
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def read_last_boot(home, instance_type, instance_id):
+    """
+    Events of the last boot from bootstrap-timings.jsonl written by the bootstrap script
+    """
+    events = read_jsonl(get_bootstrap_timings_filename(home, instance_type, instance_id))
+    boots = [index for index, event in enumerate(events) if event["Phase"] == "boot" and event["Event"] == "start"]
+    return events[boots[-1]:] if boots else events
+
+
+def read_nfs_probe(home, instance_type, instance_id):
+    """
+    EFS write throughput and metadata latency measured by the bootstrap script, None when not recorded
+    """
+    probes = [event for event in read_last_boot(home, instance_type, instance_id) if event["Phase"] == "nfs-probe"]
+    return probes[-1] if probes else None
+
+
+def read_bootstrap_timings(home, instance_type, instance_id):
+    """
+    Phase durations of the last boot from bootstrap-timings.jsonl written by the bootstrap script
+    """
+    events = read_last_boot(home, instance_type, instance_id)
+    starts = {}
+    phases = {}
+    for event in events:
+        if event["Event"] == "start":
+            starts[event["Phase"]] = event["Time"]
+        elif event["Event"] == "end" and event["Phase"] in starts:
+            phases[event["Phase"]] = round(event["Time"] - starts[event["Phase"]], 1)
+    return phases
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+    """
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def load_launches(instance_id=None):
+    """
+    Client timings merged with host bootstrap timings, optionally for a single instance
+    """
+    home = get_home()
+    launches = []
+    for record in read_jsonl(get_launch_timings_filename()):
+        if instance_id and record["InstanceId"] != instance_id:
+            continue
+        record["Bootstrap"] = read_bootstrap_timings(home, record["InstanceType"], record["InstanceId"])
+        record["NfsProbe"] = read_nfs_probe(home, record["InstanceType"], record["InstanceId"])
+        if record.get("DockerVolume"):
+            volume = read_jsonl(get_docker_volume_filename(home, record["InstanceType"], record["InstanceId"]))
+            record["DockerVolume"]["UsedBytes"] = volume[-1].get("UsedBytes", 0) if volume else 0
+        launches.append(record)
+    return launches
+
+
+def format_volume_report(launches):
+    """
+    Docker data volume cache hit ratio, docker data found on a reused or restored volume at boot
+    did not have to be pulled again
+    """
+    volumes = [launch["DockerVolume"] for launch in launches if launch.get("DockerVolume")]
+    if len(volumes) == 0:
+        return None
+    hits = [volume for volume in volumes if volume["Source"] != "new"]
+    reused = sum(volume.get("UsedBytes", 0) for volume in hits)
+    return f"Docker volume cache: {100 * len(hits) / len(volumes):.0f}% hit ({len(hits)} of {len(volumes)} launches), " \
+        f"{reused / 1024 ** 3:.1f} GiB not re-pulled"
+
+
+def format_nfs_report(launches):
+    probes = [launch["NfsProbe"] for launch in launches if launch.get("NfsProbe")]
+    if len(probes) == 0:
+        return None
+    if len(probes) == 1:
+        probe = probes[0]
+        return f"NFS probe: {probe['WriteMiBps']:.0f} MiB/s write, {probe['LatencyMs']:.1f}ms metadata latency " \
+            f"(mount target {probe['MountTarget']} from {probe['AvailabilityZone']})"
+    return f"NFS probe: median {percentile([probe['WriteMiBps'] for probe in probes], 50):.0f} MiB/s write, " \
+        f"median {percentile([probe['LatencyMs'] for probe in probes], 50):.1f}ms metadata latency over {len(probes)} hosts"
+
+
+def format_report(launches):
+    """
+    Single launch: all client and bootstrap phases. Several launches: p50/p90/max per phase
+    """
+    if len(launches) == 0:
+        return "No launch timings recorded"
+    if len(launches) == 1:
+        launch = launches[0]
+        lines = [f"{launch['InstanceId']} ({launch['InstanceType']}), ready after {launch.get('ReadyTime', 0):.1f}s"]
+        for phase, duration in launch["Phases"].items():
+            lines.append(f"  client    {phase:<24} {duration:>8.1f}s")
+        for phase, duration in launch["Bootstrap"].items():
+            lines.append(f"  bootstrap {phase:<24} {duration:>8.1f}s")
+        for report in [format_volume_report(launches), format_nfs_report(launches)]:
+            if report:
+                lines.append(report)
+        return "\n".join(lines)
+    samples = {}
+    for launch in launches:
+        for phase, duration in launch["Phases"].items():
+            samples.setdefault(("client", phase), []).append(duration)
+        for phase, duration in launch["Bootstrap"].items():
+            samples.setdefault(("bootstrap", phase), []).append(duration)
+        if "ReadyTime" in launch:
+            samples.setdefault(("total", "ReadyTime"), []).append(launch["ReadyTime"])
+    lines = [f"{len(launches)} launches", f"  {'':<9} {'PHASE':<24} {'COUNT':>5} {'P50':>8} {'P90':>8} {'MAX':>8}"]
+    for (source, phase), values in samples.items():
+        lines.append(
+            f"  {source:<9} {phase:<24} {len(values):>5} {percentile(values, 50):>7.1f}s"
+            f" {percentile(values, 90):>7.1f}s {max(values):>7.1f}s"
+        )
+    for report in [format_volume_report(launches), format_nfs_report(launches)]:
+        if report:
+            lines.append(report)
+    return "\n".join(lines)
@@ -0,0 +1,100 @@
+import logging as log
+
+data_volume_tag = {"Key": "sdocker:DockerData", "Value": "true"}
+device_name = "/dev/sdf"
+snapshots_kept = 2
+
+
+def owner_filters(owner_tag):
+    return [
+        {"Name": f"tag:{owner_tag['Key']}", "Values": [owner_tag["Value"]]},
+        {"Name": f"tag:{data_volume_tag['Key']}", "Values": [data_volume_tag["Value"]]}
+    ]
+
+
+def latest_snapshot(ec2_client, owner_tag):
+    response = ec2_client.describe_snapshots(
+        OwnerIds=["self"],
+        Filters=owner_filters(owner_tag) + [{"Name": "status", "Values": ["completed"]}]
+    )
+    snapshots = sorted(response["Snapshots"], key=lambda snapshot: snapshot["StartTime"], reverse=True)
+    return snapshots[0] if snapshots else None
+
+
+def find_or_create_volume(ec2_client, owner_tag, availability_zone, size, excluded=[]):
+    """
+    Docker data volume for availability zone, in order of preference: an available volume of the user in
+    the availability zone, a new volume restored from the latest snapshot of the user, a new empty volume.
+    Returns (volume id, source) where source is "volume", "snapshot" or "new"
+    """
+    response = ec2_client.describe_volumes(
+        Filters=owner_filters(owner_tag) + [
+            {"Name": "availability-zone", "Values": [availability_zone]},
+            {"Name": "status", "Values": ["available"]}
+        ]
+    )
+    volumes = [volume for volume in response["Volumes"] if volume["VolumeId"] not in excluded]
+    if volumes:
+        return (volumes[0]["VolumeId"], "volume")
+    args = {
+        "AvailabilityZone": availability_zone,
+        "VolumeType": "gp3",
+        "TagSpecifications": [{
+            "ResourceType": "volume",
+            "Tags": [owner_tag, data_volume_tag, {"Key": "Name", "Value": "DockerHostData"}]
+        }]
+    }
+    snapshot = latest_snapshot(ec2_client, owner_tag)
+    if snapshot:
+        args["SnapshotId"] = snapshot["SnapshotId"]
+        args["Size"] = max(size, snapshot["VolumeSize"])
+        source = "snapshot"
+    else:
+        args["Size"] = size
+        source = "new"
+    volume_id = ec2_client.create_volume(**args)["VolumeId"]
+    ec2_client.get_waiter("volume_available").wait(VolumeIds=[volume_id], WaiterConfig={"Delay": 2, "MaxAttempts": 60})
+    log.info(f"Created docker data volume {volume_id} in {availability_zone} from {source}")
+    return (volume_id, source)
+
+
+def attach_volume(ec2_client, owner_tag, instance_id, availability_zone, size):
+    """
+    Attach a docker data volume to instance, retrying with another volume when a concurrent
+    sdocker process attached the chosen one first. Returns (volume id, source)
+    """
+    excluded = []
+    while True:
+        volume_id, source = find_or_create_volume(ec2_client, owner_tag, availability_zone, size, excluded)
+        try:
+            ec2_client.attach_volume(VolumeId=volume_id, InstanceId=instance_id, Device=device_name)
+            log.info(f"Attached docker data volume {volume_id} ({source}) to {instance_id}")
+            return (volume_id, source)
+        except ec2_client.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] not in ["VolumeInUse", "IncorrectState"] or source != "volume":
+                raise
+            log.info(f"Docker data volume {volume_id} was taken, trying another one")
+            excluded.append(volume_id)
+
+
+def snapshot_volumes(ec2_client, owner_tag, instance_ids):
+    """
+    Snapshot docker data volumes attached to instances, keeping the latest snapshots_kept snapshots of the user
+    """
+    response = ec2_client.describe_volumes(
+        Filters=owner_filters(owner_tag) + [{"Name": "attachment.instance-id", "Values": instance_ids}]
+    )
+    snapshot_ids = []
+    for volume in response["Volumes"]:
+        snapshot_ids.append(ec2_client.create_snapshot(
+            VolumeId=volume["VolumeId"],
+            Description=f"sdocker docker data {owner_tag['Value']}",
+            TagSpecifications=[{"ResourceType": "snapshot", "Tags": [owner_tag, data_volume_tag]}]
+        )["SnapshotId"])
+        log.info(f"Creating snapshot {snapshot_ids[-1]} of docker data volume {volume['VolumeId']}")
+    response = ec2_client.describe_snapshots(OwnerIds=["self"], Filters=owner_filters(owner_tag))
+    snapshots = sorted(response["Snapshots"], key=lambda snapshot: snapshot["StartTime"], reverse=True)
+    for snapshot in snapshots[snapshots_kept + len(snapshot_ids):]:
+        log.info(f"Deleting old docker data snapshot {snapshot['SnapshotId']}")
+        ec2_client.delete_snapshot(SnapshotId=snapshot["SnapshotId"])
+    return snapshot_ids
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess
+import logging as log
+from config import get_home
+from cache import atomic_write_json
+from readiness import timeout
+
+# status files of finished watchers are removed after a day
+status_ttl = 24 * 3600
+# a watcher in another Studio app that wrote no status for this long is considered gone, a phase never takes longer
+# than the readiness timeout
+remote_watcher_timeout = 2 * timeout
+
+
+def get_watch_dir():
+    return f"{get_home()}/.sagemaker_studio_docker_cli/watch"
+
+
+def get_watch_filename(instance_id):
+    return f"{get_watch_dir()}/{instance_id}.json"
+
+
+def write_watch_status(instance_id, status, phase=None, pid=None, **details):
+    """
+    Status of a host readied in the background: waiting (in phase), ready or failed, pid is the watcher process.
+    Status files are on the shared EFS home, the hostname tells which Studio app the pid belongs to
+    """
+    try:
+        atomic_write_json(get_watch_filename(instance_id), {
+            "InstanceId": instance_id,
+            "Status": status,
+            "Phase": phase,
+            "Pid": pid or os.getpid(),
+            "Hostname": socket.gethostname(),
+            "Updated": time.time(),
+            **details
+        })
+    except Exception as error:
+        log.error(f"Failed to write watcher status of {instance_id}: {error}")
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def read_watch_status(instance_id):
+    """
+    Watcher status of host, None when no watcher ran for it. A waiting host whose watcher process is gone is failed,
+    the process is only checked in the Studio app running the watcher, other apps wait for remote_watcher_timeout
+    """
+    try:
+        with open(get_watch_filename(instance_id), "r") as file:
+            status = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    local = status.get("Hostname") == socket.gethostname()
+    if status["Status"] == "waiting" and local and not process_alive(status["Pid"]):
+        status["Status"] = "failed"
+        status["Error"] = f"watcher process {status['Pid']} exited, see sdocker.log"
+    elif status["Status"] == "waiting" and not local and time.time() - status["Updated"] > remote_watcher_timeout:
+        status["Status"] = "failed"
+        status["Error"] = f"no progress from watcher {status['Pid']} on {status.get('Hostname')}, see its sdocker.log"
+    return status
+
+
+def prune_watch_status():
+    watch_dir = get_watch_dir()
+    if not os.path.isdir(watch_dir):
+        return
+    for name in os.listdir(watch_dir):
+        filename = os.path.join(watch_dir, name)
+        try:
+            if time.time() - os.path.getmtime(filename) > status_ttl:
+                os.remove(filename)
+        except OSError:
+            pass
+
+
+def start_watcher(instance_ids):
+    """
+    Start a detached `sdocker watch-host` process for hosts, always in-process so it never holds the agent
+    """
+    prune_watch_status()
+    sdocker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sdocker")
+    process = subprocess.Popen(
+        [sys.executable, sdocker, "watch-host", *instance_ids],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "SDOCKER_NO_AGENT": "1"},
+        start_new_session=True
+    )
+    # reap the watcher when it exits before this process (eg. create-host run by the agent)
+    threading.Thread(target=process.wait, daemon=True).start()
+    for instance_id in instance_ids:
+        write_watch_status(instance_id, "waiting", "Launched", pid=process.pid)
+    log.info(f"Started watcher {process.pid} for {instance_ids}")
+    return process.pid
+
+
+def format_watch_status(status, elapsed):
+    line = f"{elapsed:>5.0f}s {status['InstanceId']}: {status['Status']}"
+    if status["Status"] == "waiting" and status.get("Phase"):
+        line += f" ({status['Phase']})"
+    if status["Status"] == "ready" and "ReadyTime" in status:
+        line += f" after {status['ReadyTime']:.0f}s"
+    if status["Status"] == "failed" and status.get("Error"):
+        line += f": {status['Error']}"
+    return line
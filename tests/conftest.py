@@ -0,0 +1,5 @@
+import os
+import sys
+
+# sdocker modules import each other as top level modules, like the sdocker script does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "sagemaker_studio_docker_cli"))
@@ -0,0 +1,34 @@
+from bootstrap import generate_bootstrap_script
+from idle import get_idle_monitor_filename, write_idle_monitor, idle_monitor_script
+
+# EC2 rejects raw user data above 16 KB
+user_data_limit = 16384
+
+
+def test_user_data_fits_with_all_options():
+    bootstrap_script = generate_bootstrap_script(
+        "/home/sagemaker-user",
+        "10.0.0.10",
+        1111,
+        "1000",
+        "--gpus all",
+        "sagemaker-studio-docker-cli",
+        "echo pre-bootstrap",
+        "echo post-bootstrap",
+        ["8888", "8080"],
+        persistent_volume=True,
+        instance_store=True,
+        prefetch_images=["python:3.11-slim", "public.ecr.aws/docker/library/ubuntu:22.04"],
+        registry_mirror="local",
+        efs_mount_targets={"us-east-1a": "10.0.1.10", "us-east-1b": "10.0.2.10"},
+        idle_timeout=7200,
+        idle_action="stop"
+    )
+    assert len(bootstrap_script.encode()) < user_data_limit
+
+
+def test_idle_monitor_written_to_host_folder(tmp_path):
+    write_idle_monitor(str(tmp_path), "c5.xlarge", "i-0123456789abcdef0")
+    filename = get_idle_monitor_filename(str(tmp_path), "c5.xlarge", "i-0123456789abcdef0")
+    with open(filename) as file:
+        assert file.read() == idle_monitor_script
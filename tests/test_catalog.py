@@ -0,0 +1,77 @@
+import pytest
+from catalog import select_instance_type, gpu_count
+
+
+def entry(instance_type, vcpus, memory_gib, gpus=0, azs=("us-east-1a", "us-east-1b"), current=True, bare_metal=False,
+          burstable=False, usage_classes=("on-demand", "spot"), architectures=("x86_64",)):
+    info = {
+        "InstanceType": instance_type,
+        "CurrentGeneration": current,
+        "BareMetal": bare_metal,
+        "BurstablePerformanceSupported": burstable,
+        "SupportedUsageClasses": list(usage_classes),
+        "ProcessorInfo": {"SupportedArchitectures": list(architectures)},
+        "VCpuInfo": {"DefaultVCpus": vcpus},
+        "MemoryInfo": {"SizeInMiB": memory_gib * 1024},
+        "InstanceStorageSupported": False,
+        "AvailabilityZones": list(azs)
+    }
+    if gpus:
+        info["GpuInfo"] = {"Gpus": [{"Name": "T4", "Count": gpus}]}
+    return info
+
+
+def catalog(*entries):
+    return {info["InstanceType"]: info for info in entries}
+
+
+azs = ["us-east-1a", "us-east-1b"]
+
+
+def test_smallest_matching_type():
+    types = catalog(entry("c5.xlarge", 4, 8), entry("m5.xlarge", 4, 16), entry("c5.2xlarge", 8, 16), entry("m5.2xlarge", 8, 32))
+    assert select_instance_type(types, azs, cpus=4)["InstanceType"] == "c5.xlarge"
+    assert select_instance_type(types, azs, cpus=4, memory=16)["InstanceType"] == "m5.xlarge"
+    assert select_instance_type(types, azs, memory=20)["InstanceType"] == "m5.2xlarge"
+
+
+def test_memory_weighs_a_quarter_of_a_vcpu_per_gib():
+    # 8 + 16/4 = 12 against 4 + 64/4 = 20
+    types = catalog(entry("c5.2xlarge", 8, 16), entry("r5.xlarge", 4, 64))
+    assert select_instance_type(types, azs, cpus=4)["InstanceType"] == "c5.2xlarge"
+
+
+def test_excluded_types():
+    types = catalog(
+        entry("t3.xlarge", 4, 8, burstable=True),
+        entry("c5.metal", 4, 8, bare_metal=True),
+        entry("c5.spotonly", 4, 8, usage_classes=("spot",)),
+        entry("c6g.xlarge", 4, 8, architectures=("arm64",)),
+        entry("m5.2xlarge", 8, 32)
+    )
+    assert select_instance_type(types, azs, cpus=4)["InstanceType"] == "m5.2xlarge"
+
+
+def test_current_generation_first():
+    types = catalog(entry("c4.xlarge", 4, 8, current=False), entry("m5.2xlarge", 8, 32))
+    assert select_instance_type(types, azs, cpus=4)["InstanceType"] == "m5.2xlarge"
+
+
+def test_gpu_types_only_when_requested():
+    types = catalog(entry("g4dn.xlarge", 4, 16, gpus=1), entry("g4dn.12xlarge", 48, 192, gpus=4), entry("m5.2xlarge", 8, 32))
+    assert select_instance_type(types, azs, cpus=4)["InstanceType"] == "m5.2xlarge"
+    assert select_instance_type(types, azs, gpus=1)["InstanceType"] == "g4dn.xlarge"
+    selected = select_instance_type(types, azs, gpus=2)
+    assert selected["InstanceType"] == "g4dn.12xlarge" and gpu_count(selected) == 4
+
+
+def test_availability_zones():
+    types = catalog(entry("c5.xlarge", 4, 8, azs=("us-east-1c",)), entry("m5.xlarge", 4, 16, azs=("us-east-1b",)))
+    assert select_instance_type(types, ["us-east-1a", "us-east-1b"], cpus=4)["InstanceType"] == "m5.xlarge"
+    with pytest.raises(ValueError):
+        select_instance_type(types, ["us-east-1a"], cpus=4)
+
+
+def test_no_match():
+    with pytest.raises(ValueError, match="No instance type with 128 vCPUs"):
+        select_instance_type(catalog(entry("c5.xlarge", 4, 8)), azs, cpus=128)
@@ -0,0 +1,77 @@
+import pytest
+from launch import launch_with_fallback, plan_subnets, LaunchError
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class StubEC2():
+    """
+    run_instances fails with the error code queued for its (market, subnet), succeeds otherwise
+    """
+    class exceptions():
+        ClientError = ClientError
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = []
+
+    def run_instances(self, **args):
+        market = args.get("InstanceMarketOptions", {}).get("MarketType", "on-demand")
+        self.calls.append((market, args["SubnetId"], args.get("InstanceInitiatedShutdownBehavior")))
+        if (market, args["SubnetId"]) in self.errors:
+            raise ClientError(self.errors[(market, args["SubnetId"])])
+        return {"Instances": [{"InstanceId": "i-1", "SubnetId": args["SubnetId"]}]}
+
+
+subnet_azs = {"subnet-a": "us-east-1a", "subnet-b": "us-east-1b"}
+args = {"InstanceType": "c5.xlarge", "InstanceInitiatedShutdownBehavior": "stop"}
+
+
+def test_next_subnet_on_capacity_error():
+    ec2 = StubEC2({("on-demand", "subnet-a"): "InsufficientInstanceCapacity"})
+    response, attempts = launch_with_fallback(ec2, args, ["subnet-a", "subnet-b"], subnet_azs)
+    assert response["Instances"][0]["SubnetId"] == "subnet-b"
+    assert [(attempt["SubnetId"], attempt.get("Error")) for attempt in attempts] == \
+        [("subnet-a", "InsufficientInstanceCapacity"), ("subnet-b", None)]
+    assert attempts[-1]["AvailabilityZone"] == "us-east-1b"
+
+
+def test_spot_in_every_subnet_before_on_demand():
+    ec2 = StubEC2({
+        ("spot", "subnet-a"): "InsufficientInstanceCapacity",
+        ("spot", "subnet-b"): "SpotMaxPriceTooLow"
+    })
+    _, attempts = launch_with_fallback(ec2, args, ["subnet-a", "subnet-b"], subnet_azs, spot=True)
+    assert [call[:2] for call in ec2.calls] == [("spot", "subnet-a"), ("spot", "subnet-b"), ("on-demand", "subnet-a")]
+    assert attempts[-1]["Market"] == "on-demand"
+
+
+def test_spot_hosts_terminate_on_shutdown():
+    ec2 = StubEC2({("spot", "subnet-a"): "InsufficientInstanceCapacity"})
+    launch_with_fallback(ec2, args, ["subnet-a"], subnet_azs, spot=True)
+    assert [call[2] for call in ec2.calls] == ["terminate", "stop"]
+
+
+def test_other_errors_are_raised():
+    ec2 = StubEC2({("on-demand", "subnet-a"): "InvalidParameterValue"})
+    with pytest.raises(ClientError):
+        launch_with_fallback(ec2, args, ["subnet-a", "subnet-b"], subnet_azs)
+    assert len(ec2.calls) == 1
+
+
+def test_no_capacity_anywhere():
+    ec2 = StubEC2({(market, subnet): "InsufficientInstanceCapacity" for market in ["spot", "on-demand"] for subnet in subnet_azs})
+    with pytest.raises(LaunchError) as error:
+        launch_with_fallback(ec2, args, ["subnet-a", "subnet-b"], subnet_azs, spot=True)
+    assert len(error.value.attempts) == 4
+
+
+def test_plan_subnets_keeps_offered_availability_zones():
+    info = {"InstanceType": "c5.xlarge", "AvailabilityZones": ["us-east-1b"]}
+    assert plan_subnets(info, ["subnet-a", "subnet-b"], subnet_azs) == ["subnet-b"]
+    with pytest.raises(LaunchError):
+        plan_subnets({**info, "AvailabilityZones": ["us-east-1c"]}, ["subnet-a", "subnet-b"], subnet_azs)
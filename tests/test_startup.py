@@ -0,0 +1,79 @@
+import os
+import json
+import sys
+import subprocess
+
+sdocker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "sagemaker_studio_docker_cli", "sdocker")
+# modules that dominate sdocker startup, --help must never pay for them
+heavy_modules = ["boto3", "botocore", "requests"]
+
+
+def imported_modules(*args):
+    """
+    Top level packages imported by an sdocker call, from the python -X importtime report
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", sdocker, *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "SDOCKER_NO_AGENT": "1"}
+    )
+    assert result.returncode == 0, result.stderr
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+def test_help_imports_no_heavy_modules():
+    modules = imported_modules("--help")
+    assert "parse" in modules
+    assert modules.isdisjoint(heavy_modules), modules.intersection(heavy_modules)
+
+
+def test_command_help_imports_no_heavy_modules():
+    for command in ["create-host", "timings", "build", "wait"]:
+        modules = imported_modules(command, "--help")
+        assert modules.isdisjoint(heavy_modules), f"{command}: {modules.intersection(heavy_modules)}"
+
+
+# runs the sdocker script in-process with Studio metadata files of a test home, then reports loaded modules
+run_command = """
+import sys, json, runpy
+sys.path.insert(0, sys.argv[1])
+import config
+config.internal_metadata, config.resource_metadata = sys.argv[2], sys.argv[3]
+sys.argv = ["sdocker", *sys.argv[4:]]
+try:
+    runpy.run_path(config.__file__.replace("config.py", "sdocker"), run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+
+
+def command_modules(tmp_path, *args):
+    """
+    Top level packages loaded by an sdocker command run without agent against a test home
+    """
+    (tmp_path / ".sagemaker_studio_docker_cli").mkdir(parents=True)
+    internal_metadata = tmp_path / "internal-metadata.json"
+    internal_metadata.write_text(json.dumps({"AppNetworkAccessType": "VpcOnly"}))
+    resource_metadata = tmp_path / "resource-metadata.json"
+    resource_metadata.write_text(json.dumps({"UserProfileName": "user", "DomainId": "d-test"}))
+    result = subprocess.run(
+        [sys.executable, "-c", run_command, os.path.dirname(sdocker), str(internal_metadata), str(resource_metadata), *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "HOME": str(tmp_path), "REGION_NAME": "us-east-1", "SDOCKER_NO_AGENT": "1"}
+    )
+    assert result.returncode == 0, result.stderr
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def test_local_commands_import_no_heavy_modules(tmp_path):
+    for command in ["timings", "wait"]:
+        modules = command_modules(tmp_path / command, command)
+        assert "commands" in modules, command
+        assert modules.isdisjoint(heavy_modules), f"{command}: {modules.intersection(heavy_modules)}"